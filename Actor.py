@@ -1,19 +1,21 @@
 from __future__ import annotations
-from PIL import Image
-from io import BytesIO
-from matplotlib.patches import Rectangle, Polygon
-from scipy import ndimage
-from typing import List
-import cairosvg
+from typing import TYPE_CHECKING, List, Set, Tuple, Union
+import bisect
 import copy
-import matplotlib.pyplot as plt
+import heapq
 import numpy as np
 import math
-from colour import Color
 
 from Point import *
 from Texture import Texture
 from Controller import Controller
+from SpatialIndex import SpatialIndex
+
+# Only the scenes that are rendered import Matplotlib, and only the ones
+# that change colors import colour
+if TYPE_CHECKING:
+    from colour import Color
+    from Renderer import Renderer
 
 
 class Callback:
@@ -32,6 +34,11 @@ class Callback:
     def init(self) -> None:
         return
 
+    def wake_time(self) -> float:
+        """Get the time the callback has to be stepped from. Callbacks that
+        do nothing until then are not stepped before it."""
+        return -math.inf
+
 
 class DeleteAfterDisappearCB(Callback):
     def __init__(self) -> None:
@@ -49,6 +56,9 @@ class DeleteAfterDisappearCB(Callback):
 
 
 class PeriodCB(Callback):
+    # Whether steps before start_time do nothing but update progress
+    IDLE_BEFORE_START = False
+
     def __init__(self, start_time: float = 0,
                  end_time: float = float("inf")) -> None:
         super().__init__()
@@ -63,8 +73,16 @@ class PeriodCB(Callback):
         if self.time > self.end_time:
             self.is_done = True
 
+    def wake_time(self) -> float:
+        if self.IDLE_BEFORE_START:
+            # Done after end_time, even if before start_time
+            return min(self.start_time, self.end_time)
+        return super().wake_time()
+
 
 class FadeInOutCB(PeriodCB):
+    IDLE_BEFORE_START = True
+
     def __init__(self, start_time: float = 0, end_time: float = float("inf"),
                  fadein_time: float = 1, fadeout_time: float = 1,
                  remove_after_fadeout: bool = True) -> None:
@@ -108,6 +126,7 @@ class TrajAddPosLifecycleCB(PeriodCB):
 
 class TextTypingCB(PeriodCB):
     actor: Text
+    IDLE_BEFORE_START = True
 
     def __init__(self, text: str, start_time: float = 0,
                  end_time: float = float("inf")) -> None:
@@ -152,6 +171,7 @@ class ChangeColorCB(PeriodCB):
     length: int
     colors: List[Color]
     color: str
+    IDLE_BEFORE_START = True
 
     def __init__(self, start_time: float, duration: float, start_color: Color,
                  end_color: Color, _step: callable, change_back: bool = False) -> None:
@@ -175,7 +195,8 @@ class ChangeColorCB(PeriodCB):
             r = self._interpolate(self.start_color.red, self.end_color.red)
             g = self._interpolate(self.start_color.green, self.end_color.green)
             b = self._interpolate(self.start_color.blue, self.end_color.blue)
-            self.color = Color(rgb=(r, g, b))
+            # Built like the given colors, without importing colour here
+            self.color = type(self.start_color)(rgb=(r, g, b))
             self._step(self.actor, self.color.hex_l)
 
     def _step(self, actor: Actor, color: str) -> None:
@@ -197,16 +218,33 @@ class ActionCB(Callback):
             self._action(self.actor)
             self.is_done = True
 
+    def wake_time(self) -> float:
+        return self.action_time
+
 
 class Actor:
     priority: int
     callbacks: List[Callback]  # For actor animation
+    # Callbacks not to be stepped yet, by the time they wake at
+    sleeping: List[Tuple[float, int, Callback]]
     time: float
     is_done: bool
 
+    # World-fixed actors that draw the same whatever the time, which can be
+    # drawn once into background tiles
+    STATIC = False
+    # Screen-fixed actors, which draw relative to the left bottom of the view
+    # and can be drawn into a HUD layer over the world
+    HUD = False
+    # Set to tell the actor apart from the others of its class in profiles
+    name: str = None
+
     def __init__(self, priority: int = 50) -> None:
+        self.owner = None
         self.priority = priority
         self.callbacks = []
+        self.sleeping = []
+        self.added_cbs = 0
         self.time = 0
         self.view = None
         self.is_done = False
@@ -214,58 +252,174 @@ class Actor:
         self.alpha = 1
 
     def add_cb(self, callback: Callback) -> None:
+        # Each actor gets its own copy, so the same callback can be added to
+        # several actors
         callback = copy.deepcopy(callback)
         callback.actor = self
         callback.init()
-        self.callbacks.append(callback)
+        # Callbacks are stepped in the order they were added, also once woken
+        callback.order = self.added_cbs
+        self.added_cbs += 1
+
+        wake_time = callback.wake_time()
+        if wake_time > self.time:
+            heapq.heappush(self.sleeping, (wake_time, callback.order, callback))
+        else:
+            self.callbacks.append(callback)
+
+    def _wake_callbacks(self, time: float) -> None:
+        while self.sleeping and self.sleeping[0][0] <= time:
+            _, _, callback = heapq.heappop(self.sleeping)
+            bisect.insort(self.callbacks, callback, key=lambda c: c.order)
+
+    def idle(self, time: float) -> bool:
+        """Get whether no callback has to be stepped at time."""
+        return not self.callbacks and \
+            (not self.sleeping or self.sleeping[0][0] > time)
+
+    @property
+    def priority(self) -> int:
+        return self._priority
+
+    @priority.setter
+    def priority(self, priority: int) -> None:
+        self._priority = priority
+        if self.owner is not None:
+            self.owner.dirty = True
 
     def step(self, time: float, view: Rect) -> None:
         self.time = time
         self.view = view
 
+        if self.sleeping and self.sleeping[0][0] <= time:
+            self._wake_callbacks(time)
         for callback in self.callbacks:
             callback.step(time, view)
         self.callbacks = [c for c in self.callbacks if not c.is_done]
 
-    def _plot(self) -> None:
+    def dormant_step(self, time: float, view: Rect) -> None:
+        """Step while out of view and idle. What is drawn once
+        back in view has to be the same as with step, but the work that only
+        matters in view can be skipped."""
+        self.step(time, view)
+
+    def catch_up(self, time: float) -> None:
+        """Skip the samples missed up to time, after coarse steps."""
+        return
+
+    def get_bounds(self) -> Rect:
+        """Get the world rect the actor draws in, or None if it is drawn
+        relative to the view or has no bounds."""
+        return None
+
+    def key(self, name: str = "") -> Tuple[int, str]:
+        return (id(self), name)
+
+    def _plot(self, renderer: Renderer) -> None:
         return
 
-    def plot(self) -> None:
+    def plot(self, renderer: Renderer) -> None:
         if self.visible:
-            self._plot()
+            self._plot(renderer)
 
     def done(self) -> bool:
         return self.is_done
 
 
 class ActorList(Actor):
+    """Actors stepped and plotted in the order of their priorities.
+
+    The actors are kept sorted: added actors are inserted after the ones of
+    the same priority, and the list is only sorted again when the priority of
+    an actor changed. Done actors are skipped, and only removed once they are
+    half of the list.
+
+    The bounds of the actors are kept in a spatial index, so that only the
+    actors in view are plotted, and the ones out of view by more than
+    DORMANT_DISTANCE meters at their last step, and idle, take a dormant
+    step.
+    """
     actors: List[Actor]
+    index: SpatialIndex
+
+    DORMANT_DISTANCE = 10
 
     def __init__(self, priority: int = 50) -> None:
         super().__init__(priority)
         self.actors = []
+        self.dirty = False
+        self.done_cnt = 0
+        # Actors added while stepping, which are inserted after it
+        self.adding = None
+        self.index = SpatialIndex()
 
     def add(self, actor: Actor) -> None:
-        self.actors.append(actor)
+        actor.owner = self
+        if self.adding is not None:
+            self.adding.append(actor)
+        else:
+            bisect.insort(self.actors, actor, key=lambda a: a.priority)
 
     def _sort_actors(self) -> None:
-        self.actors.sort(key=lambda a: a.priority)
+        if self.dirty:
+            self.actors.sort(key=lambda a: a.priority)
+            self.dirty = False
 
     def add_cb_for_all(self, callback: Callback) -> None:
         for actor in self.actors:
-            actor.add_cb(copy.deepcopy(callback))
+            if not actor.is_done:
+                actor.add_cb(callback)
+
+    def _step_actor(self, actor: Actor, awake: Set[Actor]) -> None:
+        if actor in awake or actor not in self.index or \
+                not actor.idle(self.time):
+            actor.step(self.time, self.view)
+        else:
+            actor.dormant_step(self.time, self.view)
+
+        if actor.is_done:
+            self.index.remove(actor)
+            self.done_cnt += 1
+        else:
+            self.index.update(actor, actor.get_bounds())
 
     def step(self, time: float, view: Rect) -> None:
         self._sort_actors()
         super().step(time, view)
+
+        awake = self.index.query(view, self.DORMANT_DISTANCE)
+        self.adding = []
         for actor in self.actors:
-            actor.step(self.time, self.view)
-        self.actors = [a for a in self.actors if not a.done()]
+            if not actor.is_done:
+                self._step_actor(actor, awake)
+        added, self.adding = self.adding, None
+        for actor in added:
+            self.add(actor)
+            if not actor.is_done:
+                self._step_actor(actor, awake)
+
+        if self.done_cnt * 2 > len(self.actors):
+            self.actors = [a for a in self.actors if not a.is_done]
+            self.done_cnt = 0
+
+    def catch_up(self, time: float) -> None:
+        for actor in self.actors:
+            if not actor.is_done:
+                actor.catch_up(time)
 
-    def _plot(self) -> None:
-        super()._plot()
+    def _plot(self, renderer: Renderer) -> None:
+        super()._plot(renderer)
+        shown = self.index.query(self.view)
         for actor in self.actors:
-            actor.plot()
+            if actor.is_done or \
+                    (actor in self.index and actor not in shown):
+                continue
+            if actor.STATIC:
+                renderer.plot_static(actor)
+            elif actor.HUD:
+                renderer.plot_hud(actor)
+            else:
+                actor.plot(renderer)
 
 
 class Car(Actor):
@@ -300,6 +454,19 @@ class Car(Actor):
 
         super().step(time, view)
 
+        speed = self._move(dt)
+        self.direction = np.arctan2(speed.y, speed.x) / np.pi * 180
+
+    def dormant_step(self, time: float, view: Rect) -> None:
+        # The direction is only needed to draw the texture, and is set again
+        # by the next step
+        dt = time - self.time
+        self.time = time
+        self.view = view
+        self.visible = False
+        self._move(dt)
+
+    def _move(self, dt: float) -> Point:
         speed = self.controller.get_speed()
         assert speed, "Uninitialized controller!"
         if speed.x > 30:
@@ -311,18 +478,21 @@ class Car(Actor):
         if speed.y < -5:
             speed.y = -5
         self.pos += speed * dt
-        self.direction = np.arctan2(speed.y, speed.x) / np.pi * 180
+        return speed
 
     def get_rect(self) -> Rect:
         leftbottom = Point(self.pos.x - 2, self.pos.y - 1.5)
         righttop = Point(self.pos.x + 2, self.pos.y + 1.5)
         return Rect(leftbottom, righttop)
 
+    def get_bounds(self) -> Rect:
+        return self.get_rect()
+
     def in_view(self, view: Rect) -> bool:
         rect = self.get_rect()
         return rect.leftbottom in view or rect.righttop in view
 
-    def attach_texture(self) -> None:
+    def attach_texture(self, renderer: Renderer) -> None:
         if not self.texture:
             return
 
@@ -331,22 +501,25 @@ class Car(Actor):
         rect = self.get_rect()
         if self.texture_rotate:
             self.texture.rotate_to(direction)
-        self.texture.draw(rect)
+        self.texture.draw(renderer, self.key("texture"), rect)
 
-    def _plot(self) -> None:
-        super()._plot()
+    def _plot(self, renderer: Renderer) -> None:
+        super()._plot(renderer)
 
         #  plt.scatter(self.pos.x, self.pos.y)
-        self.attach_texture()
+        self.attach_texture(renderer)
 
 
 class GetPos:
+    """Measurement functions, which take the true position and return a new
+    measured point. They must not modify the true position."""
+
     def __init__(self) -> None:
         raise("Wrong usage of class GetPos")
 
     @ classmethod
     def accurate_meas(cls, p: Point, time: float) -> Point:
-        return copy.deepcopy(p)
+        return Point(p.x, p.y)
 
     @ classmethod
     def gausian_meas(cls, loc: Point = None, scale: Point = None) -> Point:
@@ -359,10 +532,91 @@ class GetPos:
         return _gausian_meas
 
 
+class TrajectoryBuffer:
+    """Columnar store of the points of a trajectory, oldest first.
+
+    x, y and birthday are views of preallocated arrays. Points are appended
+    at the end and dropped from the front by only moving the bounds of the
+    views. When the arrays are full, the points are moved to new arrays, with
+    twice the room if they are more than half full. So the views stay valid
+    in recorded snapshots. The room left is zeroed, so that the buffers of
+    equal trajectories pickle the same in checkpoints.
+    """
+
+    def __init__(self, capacity: int = 64) -> None:
+        self.data = np.zeros((3, capacity))
+        self.start = 0
+        self.end = 0
+        # Index of the last point with a smaller x than the point before it
+        self.descent = 0
+
+    def __len__(self) -> int:
+        return self.end - self.start
+
+    @property
+    def x(self) -> np.ndarray:
+        return self.data[0, self.start:self.end]
+
+    @property
+    def y(self) -> np.ndarray:
+        return self.data[1, self.start:self.end]
+
+    @property
+    def birthday(self) -> np.ndarray:
+        return self.data[2, self.start:self.end]
+
+    def append(self, x: float, y: float, birthday: float) -> None:
+        if self.end == self.data.shape[1]:
+            n = len(self)
+            capacity = self.data.shape[1]
+            data = np.zeros((3, 2 * capacity if 2 * n > capacity
+                             else capacity))
+            data[:, :n] = self.data[:, self.start:self.end]
+            self.data = data
+            self.descent = max(0, self.descent - self.start)
+            self.start, self.end = 0, n
+
+        if len(self) and x < self.data[0, self.end - 1]:
+            self.descent = self.end
+        self.data[:, self.end] = (x, y, birthday)
+        self.end += 1
+
+    def drop(self, cnt: int) -> None:
+        """Drop the cnt oldest points."""
+        self.start = min(self.start + cnt, self.end)
+
+    def first_in(self, view: Rect) -> int:
+        """Get the index of the first point in view, or None."""
+        lo, hi = 0, len(self)
+        if self.descent <= self.start:
+            # Sorted by x, so only the points between left and right count
+            lo = int(np.searchsorted(self.x, view.leftbottom.x, "right"))
+            hi = int(np.searchsorted(self.x, view.righttop.x, "left"))
+
+        inside = view.contains(PointArray(self.x[lo:hi], self.y[lo:hi]))
+        if not inside.any():
+            return None
+        return lo + int(np.argmax(inside))
+
+    def x_range(self) -> Tuple[float, float]:
+        if self.descent <= self.start:
+            return (float(self.data[0, self.start]),
+                    float(self.data[0, self.end - 1]))
+        return float(self.x.min()), float(self.x.max())
+
+    def last(self) -> Point:
+        return Point(float(self.data[0, self.end - 1]),
+                     float(self.data[1, self.end - 1]))
+
+
 class Trajectory(Actor):
-    trajectory: List[Point]
+    trajectory: TrajectoryBuffer
     ANIMATION_TIME = 1
     MARKER_SIZE = 120
+    # Alpha of new points when they pop in, relative to the trajectory
+    POP_IN_ALPHA = 1
+    # Meters the markers may be drawn past the points
+    MARKER_MARGIN = 2
 
     DEFAULT_MARKER_STYLE = {
         "marker": "+",
@@ -380,7 +634,7 @@ class Trajectory(Actor):
                  marker_style: dict = None, line_style: dict = None):
         super().__init__()
 
-        self.trajectory = []
+        self.trajectory = TrajectoryBuffer()
         self.car = car
         self.sample_period = sample_period
         self.last_add_pos_time = 0
@@ -397,61 +651,85 @@ class Trajectory(Actor):
         raise Exception("Uninitialized")
 
     def _create_pos(self) -> Point:
-        pos = self._get_pos(copy.deepcopy(self.car.pos), self.time)
-        pos.birthday = self.time
-        return pos
+        return self._get_pos(self.car.pos, self.time)
 
     def get_recent_meas(self) -> Point:
-        if self.trajectory:
-            return self.trajectory[-1]
+        if len(self.trajectory):
+            return self.trajectory.last()
 
     def step(self, time: float, view: Rect) -> None:
         super().step(time, view)
 
         # Remove outdated points
         self._update_pos(self.view)
+        self._sample()
 
+    def dormant_step(self, time: float, view: Rect) -> None:
+        # No point is in view, so none is outdated
+        super().step(time, view)
+        self._sample()
+
+    def _sample(self) -> None:
         if self.time - self.last_add_pos_time >= self.sample_period:
             pos = self._create_pos()
             self.last_add_pos_time += self.sample_period
             if self._should_add_pos:
-                self.trajectory.append(pos)
-
-    def _update_pos(self, view: Rect) -> None:
-        # Remove trajectories out of view
-        first_idx = 0
-        for idx, p in enumerate(self.trajectory):
-            if p in view:
-                first_idx = idx
-                break
-
-        self.trajectory = [p for idx, p in enumerate(
-            self.trajectory) if idx + 1 >= first_idx]
+                self.trajectory.append(pos.x, pos.y, self.time)
 
-    def getxy(self, trajectory: List[Point] = None) -> None:
-        trajectory = trajectory if trajectory else self.trajectory
-        X = [p.x for p in trajectory]
-        Y = [p.y for p in trajectory]
-        return X, Y
+    def catch_up(self, time: float) -> None:
+        # Else a point would be added on every step until caught up
+        missed = math.floor((time - self.last_add_pos_time) /
+                            self.sample_period)
+        if missed > 0:
+            self.last_add_pos_time += missed * self.sample_period
 
-    def _plot(self) -> None:
-        super()._plot()
+    def _update_pos(self, view: Rect) -> None:
+        # Remove trajectories out of view, but the last one before the view
+        first_idx = self.trajectory.first_in(view)
+        if first_idx:
+            self.trajectory.drop(first_idx - 1)
+
+    def get_bounds(self) -> Rect:
+        if not len(self.trajectory):
+            return None
+        left, right = self.trajectory.x_range()
+        return Rect(Point(left - self.MARKER_MARGIN, -math.inf),
+                    Point(right + self.MARKER_MARGIN, math.inf))
+
+    def getxy(self) -> Tuple[np.ndarray, np.ndarray]:
+        return self.trajectory.x, self.trajectory.y
+
+    def get_marker_sizes(self) -> np.ndarray:
+        # New points pop in from 8 times the marker size
+        age = self.time - self.trajectory.birthday
+        ratio = np.where(age <= self.ANIMATION_TIME,
+                         1 + 7 * (1 - age / self.ANIMATION_TIME), 1)
+        return self.MARKER_SIZE * ratio
+
+    def get_marker_alphas(self) -> Union[float, np.ndarray]:
+        # New points fade in from POP_IN_ALPHA
+        age = self.time - self.trajectory.birthday
+        new = age <= self.ANIMATION_TIME
+        if self.POP_IN_ALPHA == 1 or not new.any():
+            return self.alpha
+        progress = np.clip(age / self.ANIMATION_TIME, 0, 1)
+        ratio = np.where(new, self.POP_IN_ALPHA +
+                         (1 - self.POP_IN_ALPHA) * progress, 1)
+        return self.alpha * ratio
+
+    def _plot(self, renderer: Renderer) -> None:
+        super()._plot(renderer)
 
         # Plot dotted lines
         X, Y = self.getxy()
-        plt.plot(X, Y, **self.line_style, alpha=self.alpha)
-
-        old_trajectory = [p for p in self.trajectory
-                          if self.time - p.birthday > self.ANIMATION_TIME]
-        X, Y = self.getxy(old_trajectory)
-        plt.scatter(X, Y, s=self.MARKER_SIZE, **self.marker_style, alpha=self.alpha)
+        renderer.line(self.key("line"), X, Y, **self.line_style,
+                      alpha=self.alpha)
 
-        new_trajectory = [p for p in self.trajectory
-                          if self.time - p.birthday <= self.ANIMATION_TIME]
-        for p in new_trajectory:
-            ratio = 1 + 7 * (1 - (self.time - p.birthday) / self.ANIMATION_TIME)
-            plt.scatter(p.x, p.y, s=self.MARKER_SIZE *
-                        ratio, **self.marker_style, alpha=self.alpha)
+        # One collection for all the points, whose sizes and alphas animate
+        # the new ones
+        renderer.scatter(self.key("markers"), X, Y,
+                         s=self.get_marker_sizes(), **self.marker_style,
+                         alpha=self.get_marker_alphas())
 
 
 class LaneDetection(Actor):
@@ -511,6 +789,12 @@ class LaneDetection(Actor):
                 self.mpos.y = mpos.y
                 self.last_get_pos_time += self.sample_period
 
+    def catch_up(self, time: float) -> None:
+        missed = math.floor((time - self.last_get_pos_time) /
+                            self.sample_period)
+        if missed > 0:
+            self.last_get_pos_time += missed * self.sample_period
+
     def find_adjecent_lanes(self, y: float) -> Tuple(float, float):
         bigger = [l for l in self.lanes if l >= y]
         smaller = [l for l in self.lanes if l < y]
@@ -520,29 +804,33 @@ class LaneDetection(Actor):
 
         return upper_first, lower_first
 
-    def _plot(self) -> None:
-        super()._plot()
+    def _plot(self, renderer: Renderer) -> None:
+        super()._plot(renderer)
 
         upper, lower = self.find_adjecent_lanes(self.car.pos.y)
 
         if upper is not None and lower is not None:
             # Draw marker
-            plt.scatter(self.mpos.x, self.mpos.y, s=self.MARKER_SIZE,
-                        **self.marker_style)
-            plt.plot([self.car.pos.x+2, self.mpos.x], [
-                     self.mpos.y, self.mpos.y], **self.line_style)
+            renderer.scatter(self.key("marker"), [self.mpos.x], [self.mpos.y],
+                             s=self.MARKER_SIZE, **self.marker_style)
+            renderer.line(self.key("line"), [self.car.pos.x+2, self.mpos.x], [
+                          self.mpos.y, self.mpos.y], **self.line_style)
 
             upper_arrow_y = self.mpos.y + .5
             lower_arrow_y = self.mpos.y - .5
-            plt.arrow(self.mpos.x, upper_arrow_y, 0, upper -
-                      upper_arrow_y, alpha=self.alpha, **self.arrow_style)
-            plt.arrow(self.mpos.x, lower_arrow_y, 0, lower -
-                      lower_arrow_y, alpha=self.alpha, **self.arrow_style)
+            renderer.arrow(self.key("upper"), self.mpos.x, upper_arrow_y, 0,
+                           upper - upper_arrow_y, alpha=self.alpha,
+                           **self.arrow_style)
+            renderer.arrow(self.key("lower"), self.mpos.x, lower_arrow_y, 0,
+                           lower - lower_arrow_y, alpha=self.alpha,
+                           **self.arrow_style)
         else:
             print("Lane detection fails to find adjecent lanes!")
 
 
 class Road(Actor):
+    STATIC = True
+
     def __init__(self):
         super().__init__(1)
 
@@ -553,50 +841,67 @@ class Road(Actor):
         self.dashed_lines = [2]  # y
         self.solid_lines = [-2, 6]  # y
 
+        # Rects of the last markings, by their keys
+        self.markings = {}
+
     def get_lines(self) -> List[float]:
         return self.dashed_lines + self.solid_lines
 
     def line_in_view(self, y: float, top: float, bottom: float) -> bool:
         return (y - self.line_width/2 < top) and (y + self.line_width/2 > bottom)
 
-    def draw_solid_line(self, line: float, left: float, right: float) -> None:
-        ax = plt.gca()
-        ax.add_patch(Rectangle((left, line-self.line_width/2),
-                     right - left, self.line_width))
-
-    def draw_dashed_line(self, line: float, left: float, right: float) -> None:
-        start = left
-        ax = plt.gca()
-
-        segment_length = sum(self.dashed_line)
-        start = segment_length * int(left / segment_length)
-
-        while start <= right:
-            end = start + self.dashed_line[0]
-            if start < left:
-                start = left
-            if end > right:
-                end = right
-            ax.add_patch(Rectangle((start, line-self.line_width/2),
-                         end - start, self.line_width))
-            start = end + self.dashed_line[1]
-
-    def _plot(self) -> None:
-        super()._plot()
-
-        left, right = self.view.leftbottom.x, self.view.righttop.x
-        bottom, top = self.view.leftbottom.y, self.view.righttop.y
-
-        for line in self.solid_lines:
-            if self.line_in_view(line, top, bottom):
-                self.draw_solid_line(line, left, right)
-
-        for line in self.dashed_lines:
-            if self.line_in_view(line, top, bottom):
-                self.draw_dashed_line(line, left, right)
+    def get_markings(self, left: float, right: float, bottom: float,
+                     top: float) -> np.ndarray:
+        """Get the rects of the lane markings in view, as rows of x, y, w, h.
+
+        They span whole periods of the dashes from the one left is in, so
+        they are only built again when the view crosses a period, or shows
+        other lines.
+        """
+        period = sum(self.dashed_line)
+        offset = period * math.floor(left / period)
+        periods = math.ceil((right - left) / period) + 1
+        solid = [l for l in self.solid_lines
+                 if self.line_in_view(l, top, bottom)]
+        dashed = [l for l in self.dashed_lines
+                  if self.line_in_view(l, top, bottom)]
+
+        key = (offset, periods, tuple(solid), tuple(dashed),
+               tuple(self.dashed_line), self.line_width)
+        if key in self.markings:
+            return self.markings[key]
+
+        starts = offset + period * np.arange(periods)
+        rects = [(offset, y - self.line_width/2, periods * period,
+                  self.line_width) for y in solid]
+        rects += [(x, y - self.line_width/2, self.dashed_line[0],
+                   self.line_width) for y in dashed for x in starts]
+        rects = np.array(rects, dtype=float).reshape(-1, 4)
+        # Read-only, so that snapshots and checkpoints can share it
+        rects.flags.writeable = False
+        # Enough for the background tiles under the view
+        if len(self.markings) >= 4:
+            self.markings.clear()
+        self.markings[key] = rects
+        return rects
+
+    def _plot(self, renderer: Renderer) -> None:
+        super()._plot(renderer)
+
+        # The view of the renderer, which is a background tile for static
+        # actors
+        view = renderer.view
+        left, right = view.leftbottom.x, view.righttop.x
+        bottom, top = view.leftbottom.y, view.righttop.y
+
+        # All the markings are drawn as one path
+        renderer.rectangles(self.key("markings"),
+                            self.get_markings(left, right, bottom, top))
 
 
 class Mux(Actor):
+    HUD = True
+
     DEFAULT_POLYGON_STYLE = {
         "facecolor": "#eeeeee",
         "linestyle": "-",
@@ -608,22 +913,23 @@ class Mux(Actor):
     def __init__(self, pos: Point, size: float = 1, polygon_style: dict = None,
                  priority: int = 50) -> None:
         super().__init__(priority)
-        points = [Point(0, 2), Point(1, 1), Point(1, -1), Point(0, -2)]
-        self.points = [p * size + pos for p in points]
+        points = PointArray([0, 1, 1, 0], [2, 1, -1, -2])
+        self.points = points * size + pos
 
         self.polygon_style = polygon_style if polygon_style is not None \
             else copy.deepcopy(self.DEFAULT_POLYGON_STYLE)
 
-    def _plot(self) -> None:
-        super()._plot()
+    def _plot(self, renderer: Renderer) -> None:
+        super()._plot(renderer)
 
-        points = [p + self.view.leftbottom for p in self.points]
-        points = np.array([[p.x, p.y] for p in points])
-        polygon = Polygon(points, alpha=self.alpha, **self.polygon_style)
-        plt.gca().add_patch(polygon)
+        points = self.points.xy() + renderer.view.leftbottom.loc()
+        renderer.polygon(self.key("polygon"), points, alpha=self.alpha,
+                         **self.polygon_style)
 
 
 class Text(Actor):
+    HUD = True
+
     DEFAULT_TEXT_STYLE = {
         "color": "#333343",
         "verticalalignment": "center",
@@ -649,16 +955,16 @@ class Text(Actor):
         if not add_box:
             self.box_style = None
 
-    def _plot(self) -> None:
-        super()._plot()
+    def _plot(self, renderer: Renderer) -> None:
+        super()._plot(renderer)
 
-        box_style = copy.deepcopy(self.box_style)
+        box_style = self.box_style
         if box_style and box_style["alpha"]:
-            box_style["alpha"] *= self.alpha
+            box_style = {**box_style, "alpha": box_style["alpha"] * self.alpha}
 
-        pos = self.text_pos + self.view.leftbottom
-        plt.text(pos.x, pos.y, self.text, alpha=self.alpha,
-                 bbox=box_style, **self.text_style).set_in_layout(False)
+        pos = self.text_pos + renderer.view.leftbottom
+        renderer.text(self.key("text"), pos.x, pos.y, self.text,
+                      alpha=self.alpha, bbox=box_style, **self.text_style)
 
 
 class TrajLegend(Text):
@@ -674,17 +980,20 @@ class TrajLegend(Text):
         if "color" not in self.text_style:
             self.text_style["color"] = self.marker_style["color"]
 
-    def _plot(self) -> None:
-        super()._plot()
+    def _plot(self, renderer: Renderer) -> None:
+        super()._plot(renderer)
 
-        pos = self.marker_pos + self.view.leftbottom
-        plt.scatter(pos.x, pos.y, s=self.MARKER_SIZE, alpha=self.alpha,
-                    **self.marker_style)
+        pos = self.marker_pos + renderer.view.leftbottom
+        renderer.scatter(self.key("marker"), [pos.x], [pos.y],
+                         s=self.MARKER_SIZE, alpha=self.alpha,
+                         **self.marker_style)
 
 
 class TextList(ActorList):
     actors: List[Text]
 
+    HUD = True
+
     TYPING_TIME = 1
 
     def __init__(self, text_list: Tuple[str, float, float, float], pos: Point,
@@ -708,6 +1017,8 @@ class TextList(ActorList):
 class PolyLine(Actor):
     lines: List[Line]
 
+    HUD = True
+
     DEFAULT_LINE_STYLE = {
         "color": "#708090",
         "linewidth": 3,
@@ -742,8 +1053,9 @@ class PolyLine(Actor):
         for delta in deltas:
             line = Line(p, delta=delta)
             self.lines.append(line)
-            p += delta
-        self.length = sum([l.length() for l in self.lines])
+            p = p + delta
+        self.lengths = [l.length() for l in self.lines]
+        self.length = sum(self.lengths)
 
     def step(self, time: float, view: Rect) -> None:
         super().step(time, view)
@@ -757,35 +1069,40 @@ class PolyLine(Actor):
         else:
             self.percentage = 1
 
-    def _plot(self) -> None:
-        super()._plot()
+    def _plot(self, renderer: Renderer) -> None:
+        super()._plot(renderer)
 
         length = self.percentage * self.length
         len_drawn = 0
         # Draw all lines but the last one without arrow
         X, Y = [], []
         arrow_line = None
-        for line in self.lines:
-            p = line.start + self.view.leftbottom
-            X.append(p.x)
-            Y.append(p.y)
-
-            if line.length() + len_drawn >= length:
-                part = (length - len_drawn) / line.length()
-                arrow_line = line.interpolate(part) + self.view.leftbottom
+        view = renderer.view
+        left, bottom = view.leftbottom.x, view.leftbottom.y
+        for line, line_length in zip(self.lines, self.lengths):
+            X.append(line.start.x + left)
+            Y.append(line.start.y + bottom)
+
+            if line_length + len_drawn >= length:
+                part = (length - len_drawn) / line_length
+                arrow_line = line.interpolate(part) + view.leftbottom
                 break
             else:
-                len_drawn += line.length()
+                len_drawn += line_length
 
-        plt.plot(X, Y, alpha=self.alpha, **self.line_style)
-        plt.arrow(arrow_line.start.x, arrow_line.start.y, arrow_line.delta.x,
-                  arrow_line.delta.y, alpha=self.alpha,
-                  **{**self.arrow_style, **self.line_style})
+        renderer.line(self.key("line"), X, Y, alpha=self.alpha,
+                      **self.line_style)
+        renderer.arrow(self.key("arrow"), arrow_line.start.x,
+                       arrow_line.start.y, arrow_line.delta.x,
+                       arrow_line.delta.y, alpha=self.alpha,
+                       **{**self.arrow_style, **self.line_style})
 
 
 class Image(Actor):
     texture: Texture
 
+    HUD = True
+
     def __init__(self, file: str, center: Point, w: float, h: float,
                  rotate: int = None, image_style: dict = None,
                  rotate_degree: float = None, priority: int = 50) -> None:
@@ -804,6 +1121,7 @@ class Image(Actor):
         righttop = Point(self.center.x + w/2, self.center.y + h/2)
         return Rect(leftbottom, righttop)
 
-    def _plot(self) -> None:
-        super()._plot()
-        self.texture.draw(self.rect + self.view.leftbottom)
+    def _plot(self, renderer: Renderer) -> None:
+        super()._plot(renderer)
+        self.texture.draw(renderer, self.key("texture"),
+                          self.rect + renderer.view.leftbottom)
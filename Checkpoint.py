@@ -0,0 +1,224 @@
+from __future__ import annotations
+from typing import Dict, List, Optional, Tuple
+import copy
+import hashlib
+from io import BytesIO
+import os
+import pickle
+import types
+import numpy as np
+
+
+class Checkpoint:
+    """Simulation state of all the objects reachable from some roots.
+
+    The objects are restored in place instead of being replaced, because
+    callbacks and measurement functions keep references to actors in their
+    closures. Read-only NumPy arrays, functions, classes and objects of
+    classes with CHECKPOINT = False are references that are kept as they
+    are.
+    """
+    objects: List[object]
+    refs: List[object]
+    states: List[dict]
+
+    def __init__(self, roots: list, **values) -> None:
+        self.objects, self.refs = self.reachable(roots)
+        memo = self._memo(self.objects, self.refs)
+        self.states, self.values = copy.deepcopy(
+            ([vars(o) for o in self.objects], values), memo)
+        self.rng_state = np.random.get_state()
+
+    @classmethod
+    def reachable(cls, roots: list) -> Tuple[List[object], List[object]]:
+        """Find the objects with a state and the references reachable from
+        roots, through attributes, containers and closures."""
+        objects, refs = [], []
+        seen = set()
+        stack = list(reversed(roots))
+        while stack:
+            o = stack.pop()
+            if id(o) in seen:
+                continue
+            seen.add(id(o))
+
+            if isinstance(o, (list, tuple, set, frozenset)):
+                children = list(o)
+            elif isinstance(o, dict):
+                children = list(o.values())
+            elif isinstance(o, types.FunctionType):
+                refs.append(o)
+                children = []
+                for cell in o.__closure__ or ():
+                    try:
+                        children.append(cell.cell_contents)
+                    except ValueError:  # Empty cell
+                        pass
+            elif isinstance(o, types.MethodType):
+                children = [o.__self__]
+            elif isinstance(o, np.ndarray):
+                if not o.flags.writeable:
+                    refs.append(o)
+                children = []
+            elif isinstance(o, (type, types.ModuleType)):
+                refs.append(o)
+                children = []
+            elif not hasattr(o, "__dict__"):
+                children = []
+            elif not getattr(o, "CHECKPOINT", True):
+                refs.append(o)
+                children = [type(o)]
+            else:
+                objects.append(o)
+                children = [type(o)] + list(vars(o).values())
+            stack.extend(reversed(children))
+        return objects, refs
+
+    @classmethod
+    def _memo(cls, objects: List[object],
+              refs: List[object]) -> Dict[int, object]:
+        # deepcopy keeps these objects instead of copying them
+        return {id(o): o for o in objects + refs}
+
+    def restore(self) -> dict:
+        """Restore the state of the objects and of the NumPy RNG, and get the
+        values saved with the checkpoint."""
+        memo = self._memo(self.objects, self.refs)
+        states, values = copy.deepcopy((self.states, self.values), memo)
+        for o, state in zip(self.objects, states):
+            vars(o).clear()
+            vars(o).update(state)
+        np.random.set_state(self.rng_state)
+        return values
+
+
+class _Pickler(pickle.Pickler):
+    def __init__(self, file, ids: Dict[int, int]) -> None:
+        super().__init__(file, pickle.HIGHEST_PROTOCOL)
+        self.ids = ids
+
+    def persistent_id(self, obj: object) -> int:
+        return self.ids.get(id(obj))
+
+
+class _Unpickler(pickle.Unpickler):
+    def __init__(self, file, table: List[object]) -> None:
+        super().__init__(file)
+        self.table = table
+
+    def persistent_load(self, pid: int) -> object:
+        return self.table[pid]
+
+
+class CheckpointDir:
+    """Checkpoints kept in a directory, to resume the renders of later runs of
+    a scene script.
+
+    It has to be created before the scene is stepped. The objects and
+    references reachable at that point are saved as their index in a table,
+    and found again in the scene built by the next run. Checkpoints of scenes
+    with different tables, or different settings like their fps, are kept in
+    different sub directories.
+
+    Attributes that were built differently by the run that saved a checkpoint,
+    e.g. a tweaked style, keep the value built by the current run if the
+    simulation did not change them. Checkpoints where it did, e.g. of a moved
+    start position, are discarded.
+    """
+    table: List[object]
+
+    def __init__(self, directory: str, roots: list,
+                 settings: dict = None) -> None:
+        self.initial = Checkpoint(roots)
+        self.table = self.initial.objects + self.initial.refs
+        self.ids = {id(o): idx for idx, o in enumerate(self.table)}
+
+        names = [self._name(o) for o in self.table]
+        names += [f"{key}={value!r}"
+                  for key, value in sorted((settings or {}).items())]
+        fingerprint = hashlib.sha1("\n".join(names).encode()).hexdigest()
+        self.directory = os.path.join(directory, fingerprint[:16])
+        self.digests = self._digests(self.initial.states)
+        # Once a checkpoint can't be pickled, the later ones are not tried
+        self.disabled = False
+        self.discarded = 0
+
+    @classmethod
+    def _name(cls, o: object) -> str:
+        if not isinstance(o, (type, types.FunctionType)):
+            o = type(o)
+        return f"{o.__module__}.{o.__qualname__}"
+
+    def _dumps(self, o: object) -> bytes:
+        with BytesIO() as f:
+            _Pickler(f, self.ids).dump(o)
+            return f.getvalue()
+
+    def _digests(self, states: List[dict]) -> Dict[Tuple[int, str], str]:
+        digests = {}
+        for idx, state in enumerate(states):
+            for attr, value in state.items():
+                digest = self._digest(value)
+                if digest is not None:
+                    digests[(idx, attr)] = digest
+        return digests
+
+    def get_filename(self, frame: int) -> str:
+        return os.path.join(self.directory, f"{frame:06d}.pkl")
+
+    def frames(self) -> List[int]:
+        if not os.path.isdir(self.directory):
+            return []
+        return [int(os.path.splitext(f)[0]) for f in os.listdir(self.directory)
+                if f.endswith(".pkl")]
+
+    def save(self, frame: int, checkpoint: Checkpoint) -> bool:
+        if self.disabled:
+            return False
+        os.makedirs(self.directory, exist_ok=True)
+        filename = self.get_filename(frame)
+        try:
+            data = self._dumps((self.digests, checkpoint))
+        except (pickle.PicklingError, AttributeError, TypeError) as e:
+            print(f"Checkpoints from frame {frame} on are kept in memory "
+                  f"only: {e}")
+            self.disabled = True
+            return False
+
+        with open(filename + ".tmp", "wb") as f:
+            f.write(data)
+        os.replace(filename + ".tmp", filename)
+        return True
+
+    def load(self, frame: int) -> Optional[Checkpoint]:
+        """Load the checkpoint of frame, or get None if it was discarded."""
+        with open(self.get_filename(frame), "rb") as f:
+            digests, checkpoint = _Unpickler(f, self.table).load()
+
+        # Keep the attributes that were built differently by the current run,
+        # unless the simulation changed them since
+        positions = {id(o): pos for pos, o in enumerate(checkpoint.objects)}
+        memo = Checkpoint._memo(self.initial.objects, self.initial.refs)
+        for (idx, attr), digest in self.digests.items():
+            pos = positions.get(id(self.table[idx]))
+            saved = digests.get((idx, attr))
+            if pos is None or saved == digest:
+                continue
+            state = checkpoint.states[pos]
+            if saved is not None and attr in state and \
+                    self._digest(state[attr]) != saved:
+                # Once, as the earlier checkpoints are likely discarded too
+                if not self.discarded:
+                    print(f"Checkpoint of frame {frame} is discarded: "
+                          f"{self._name(self.table[idx])}.{attr} was built "
+                          f"differently, and changed by the simulation")
+                self.discarded += 1
+                return None
+            state[attr] = copy.deepcopy(self.initial.states[idx][attr], memo)
+        return checkpoint
+
+    def _digest(self, value: object) -> Optional[str]:
+        try:
+            return hashlib.sha1(self._dumps(value)).hexdigest()
+        except (pickle.PicklingError, AttributeError, TypeError):
+            return None
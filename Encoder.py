@@ -0,0 +1,116 @@
+from __future__ import annotations
+from typing import List
+import os
+import subprocess
+
+
+class VideoEncoder:
+    """Encodes raw RGBA frames piped into a long-lived ffmpeg process.
+
+    ffmpeg is started with the first frame, which gives the frame size.
+    With gop, keyframes are put every gop frames, so that videos cut at
+    multiples of gop can be joined by concat().
+    """
+    process: subprocess.Popen
+
+    def __init__(self, file: str, fps: float, gop: int = None) -> None:
+        self.file = file
+        self.fps = fps
+        self.gop = gop
+        self.process = None
+        self.last_frame = None
+        self.frame_cnt = 0
+
+    def _start(self, width: int, height: int) -> None:
+        cmd = ["ffmpeg", "-y",
+               "-f", "rawvideo",
+               "-pix_fmt", "rgba",
+               "-s", f"{width}x{height}",
+               "-framerate", f"{self.fps}",
+               "-i", "-",
+               ] + self.output_args(self.gop) + [self.file]
+        self.process = subprocess.Popen(cmd, stdin=subprocess.PIPE)
+
+    @classmethod
+    def output_args(cls, gop: int = None) -> List[str]:
+        args = ["-c:v", "libx264",
+                "-profile:v", "high",
+                "-crf", "20",
+                "-pix_fmt", "yuv420p",
+                "-hide_banner",
+                "-loglevel", "error",
+                ]
+        if gop:
+            args += ["-g", f"{gop}", "-keyint_min", f"{gop}"]
+        return args
+
+    @classmethod
+    def concat(cls, files: List[str], file: str) -> None:
+        """Join the videos of files into file, without encoding them
+        again."""
+        list_file = file + ".txt"
+        with open(list_file, "w") as f:
+            for part in files:
+                f.write(f"file '{os.path.abspath(part)}'\n")
+        cmd = ["ffmpeg", "-y",
+               "-f", "concat",
+               "-safe", "0",
+               "-i", list_file,
+               "-c", "copy",
+               "-hide_banner",
+               "-loglevel", "error",
+               file]
+        try:
+            subprocess.run(cmd, check=True)
+        finally:
+            os.remove(list_file)
+
+    def write(self, frame: memoryview) -> None:
+        """Write a (height, width, 4) RGBA buffer without copying it."""
+        if self.process is None:
+            height, width = frame.shape[:2]
+            self._start(width, height)
+        self.process.stdin.write(frame)
+        self.last_frame = frame
+        self.frame_cnt += 1
+
+    def repeat(self, cnt: int) -> None:
+        """Write the last frame cnt more times."""
+        assert self.last_frame is not None, "No frame to repeat!"
+        for _ in range(cnt):
+            self.write(self.last_frame)
+
+    def __enter__(self) -> VideoEncoder:
+        return self
+
+    def __exit__(self, exc_type, *exc) -> None:
+        if exc_type is None:
+            self.close()
+        else:
+            self.kill()
+
+    def kill(self) -> None:
+        """Stop ffmpeg without finishing the video, and remove it."""
+        if self.process is None:
+            return
+        self.process.kill()
+        self.process.wait()
+        try:
+            self.process.stdin.close()
+        except OSError:
+            pass  # Frames left in the pipe
+        self.process = None
+        self.last_frame = None
+        if os.path.isfile(self.file):
+            os.remove(self.file)
+
+    def close(self) -> None:
+        if self.process is None:
+            return
+        self.process.stdin.close()
+        if self.process.wait() != 0:
+            raise Exception(
+                f"ffmpeg failed to encode {self.file}: "
+                f"exit code {self.process.returncode}")
+        self.process = None
+        self.last_frame = None
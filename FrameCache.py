@@ -0,0 +1,148 @@
+from __future__ import annotations
+from io import BytesIO
+from typing import Set
+import hashlib
+import os
+import pickle
+import shutil
+import zlib
+import numpy as np
+
+
+class FrameCache:
+    """On-disk cache of rendered frames, keyed by the digest of their
+    snapshots.
+
+    A snapshot renders the same pixels in any run, so frames that did not
+    change since the last render, or that repeat during a run, are read back
+    instead of being rendered again. Streamed frames are kept as zlib
+    compressed RGBA buffers, which are decoded much faster than PNG files,
+    and dumped frames as PNG files. When the cache grows over max_size bytes,
+    the least recently used frames are evicted at the end of the run.
+
+    A shared cache is used by processes rendering at the same time, which
+    would evict the frames that the others found. Its frames are only
+    evicted by calling evict() once they all ended.
+    """
+    pending: Set[str]
+
+    def __init__(self, directory: str, max_size: int = 2 << 30,
+                 shared: bool = False) -> None:
+        self.directory = directory
+        self.max_size = max_size
+        self.shared = shared
+        self.pending = set()
+        self.hits = 0
+        self.misses = 0
+
+        # Frames rendered by other versions of the renderer are not reused
+        import matplotlib
+        import Renderer
+        with open(Renderer.__file__, "rb") as f:
+            self.version = (matplotlib.__version__,
+                            hashlib.sha1(f.read()).hexdigest())
+
+    def key(self, snapshot: Snapshot, *settings) -> str:
+        # Artist keys only identify artists between frames, and hold ids of
+        # actors that change from run to run
+        calls = [(method, args, kwargs)
+                 for method, _, args, kwargs in snapshot.calls]
+        tiles = [(view, [(method, args, kwargs)
+                         for method, _, args, kwargs in tile_calls])
+                 for view, tile_calls in snapshot.tiles]
+        hud = None
+        if snapshot.hud is not None:
+            view, hud_calls = snapshot.hud
+            hud = (view, [(method, args, kwargs)
+                          for method, _, args, kwargs in hud_calls])
+        data = pickle.dumps((self.version, settings, snapshot.view,
+                             snapshot.title, calls, tiles, hud),
+                            pickle.HIGHEST_PROTOCOL)
+        return hashlib.sha1(data).hexdigest()
+
+    def get_filename(self, key: str, png: bool = False) -> str:
+        ext = ".png" if png else ".rgba"
+        return os.path.join(self.directory, key[:2], key + ext)
+
+    def lookup(self, filename: str) -> bool:
+        """Get whether the frame is cached, or is already being rendered by
+        this run."""
+        if filename in self.pending:
+            self.hits += 1
+            return True
+        elif os.path.isfile(filename):
+            try:
+                os.utime(filename)  # Recently used
+                self.hits += 1
+                return True
+            except FileNotFoundError:
+                pass  # Evicted since
+
+        self.pending.add(filename)
+        self.misses += 1
+        return False
+
+    @classmethod
+    def save(cls, filename: str, frame: memoryview) -> None:
+        with BytesIO() as f:
+            np.save(f, np.asarray(frame))
+            data = zlib.compress(f.getbuffer(), 1)
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
+        # By process, as scenes rendered at the same time may share frames
+        tmp_file = f"{filename}.{os.getpid()}.tmp"
+        with open(tmp_file, "wb") as f:
+            f.write(data)
+        os.replace(tmp_file, filename)
+
+    @classmethod
+    def save_file(cls, filename: str, png_file: str) -> None:
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
+        tmp_file = f"{filename}.{os.getpid()}.tmp"
+        shutil.copy(png_file, tmp_file)
+        os.replace(tmp_file, filename)
+
+    @classmethod
+    def load(cls, filename: str) -> np.ndarray:
+        with open(filename, "rb") as f:
+            data = zlib.decompress(f.read())
+        return np.load(BytesIO(data))
+
+    def begin(self) -> None:
+        self.pending.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def end(self) -> None:
+        if not self.shared:
+            self.evict()
+
+    def evict(self) -> None:
+        """Evict the least recently used frames over max_size."""
+        files = []
+        for root, _, names in os.walk(self.directory):
+            for name in names:
+                if name.endswith((".png", ".rgba")):
+                    filename = os.path.join(root, name)
+                    try:
+                        stat = os.stat(filename)
+                    except FileNotFoundError:
+                        continue
+                    files.append((stat.st_mtime, stat.st_size, filename))
+
+        size = sum(f[1] for f in files)
+        for _, file_size, filename in sorted(files):
+            if size <= self.max_size:
+                break
+            try:
+                os.remove(filename)
+            except FileNotFoundError:
+                pass
+            size -= file_size
+
+    def __str__(self) -> str:
+        total = self.hits + self.misses
+        rate = self.hits / total if total else 0
+        return f"{self.hits} hits, {self.misses} misses ({rate:.0%})"
+
+    def __repr__(self) -> str:
+        return self.__str__()
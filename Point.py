@@ -1,9 +1,12 @@
 from __future__ import annotations
-from typing import Tuple
+from typing import List, Tuple
+import math
 import numpy as np
 
 
 class Point:
+    __slots__ = ("x", "y")
+
     def __init__(self, x: int, y: int):
         self.x = x
         self.y = y
@@ -12,20 +15,35 @@ class Point:
         return (self.x, self.y)
 
     def dis(self, __o: Point) -> float:
-        assert(isinstance(__o, Point))
-        return np.sqrt((self.x - __o.x) ** 2 + (self.y - __o.y) ** 2)
+        dx = self.x - __o.x
+        dy = self.y - __o.y
+        return math.sqrt(dx * dx + dy * dy)
 
     def __add__(self, another: Point) -> Point:
-        assert isinstance(another, Point)
         return Point(self.x + another.x, self.y + another.y)
 
     def __sub__(self, another: Point) -> Point:
-        assert isinstance(another, Point)
         return Point(self.x - another.x, self.y - another.y)
 
     def __mul__(self, factor: float) -> Point:
         return Point(self.x * factor, self.y * factor)
 
+    # In place versions, for points that are not shared
+    def __iadd__(self, another: Point) -> Point:
+        self.x += another.x
+        self.y += another.y
+        return self
+
+    def __isub__(self, another: Point) -> Point:
+        self.x -= another.x
+        self.y -= another.y
+        return self
+
+    def __imul__(self, factor: float) -> Point:
+        self.x *= factor
+        self.y *= factor
+        return self
+
     def __str__(self) -> str:
         return f"({self.x}, {self.y})"
 
@@ -37,16 +55,66 @@ class Point:
         x = np.random.normal(loc=loc.x, scale=scale.x)
         y = np.random.normal(loc=loc.y, scale=scale.y)
         return Point(x, y)
-    
+
+
+class PointArray:
+    """Points stored as NumPy arrays of x and y, for vectorized operations."""
+    __slots__ = ("x", "y")
+
+    def __init__(self, x: np.ndarray, y: np.ndarray) -> None:
+        self.x = np.asarray(x, dtype=float)
+        self.y = np.asarray(y, dtype=float)
+
+    @classmethod
+    def from_points(cls, points: List[Point]) -> PointArray:
+        return PointArray([p.x for p in points], [p.y for p in points])
+
+    def __len__(self) -> int:
+        return len(self.x)
+
+    def __getitem__(self, idx: int | slice) -> Point | PointArray:
+        if isinstance(idx, slice):
+            return PointArray(self.x[idx], self.y[idx])
+        return Point(float(self.x[idx]), float(self.y[idx]))
+
+    def dis(self, p: Point) -> np.ndarray:
+        dx = self.x - p.x
+        dy = self.y - p.y
+        return np.sqrt(dx * dx + dy * dy)
+
+    def __add__(self, shift: Point) -> PointArray:
+        return PointArray(self.x + shift.x, self.y + shift.y)
+
+    def __sub__(self, shift: Point) -> PointArray:
+        return PointArray(self.x - shift.x, self.y - shift.y)
+
+    def __mul__(self, factor: float) -> PointArray:
+        return PointArray(self.x * factor, self.y * factor)
+
+    def translate(self, shift: Point) -> None:
+        self.x += shift.x
+        self.y += shift.y
+
+    def xy(self) -> np.ndarray:
+        """Get the points as an (n, 2) array."""
+        return np.column_stack([self.x, self.y])
+
+    def __str__(self) -> str:
+        return str([self[i] for i in range(len(self))])
+
+    def __repr__(self) -> str:
+        return self.__str__()
+
 
 class Line:
+    __slots__ = ("start", "end", "delta")
     start: Point
     end: Point
 
     def __init__(self, start: Point, end: Point = None,
                  delta: Point = None) -> None:
         self.start = start
-        assert bool(end) != bool(delta)
+        assert (end is None) != (delta is None)
         self.end = end if end else self.start + delta
         self.delta = self.start - self.end
 
@@ -70,15 +138,22 @@ class Line:
 
 
 class Rect:
+    __slots__ = ("leftbottom", "righttop")
+
     def __init__(self, leftbottom: Point, righttop: Point) -> None:
         self.leftbottom = leftbottom
         self.righttop = righttop
 
     def __contains__(self, p: Point) -> bool:
-        assert(isinstance(p, Point))
         return p.x > self.leftbottom.x and p.x < self.righttop.x and \
             p.y > self.leftbottom.y and p.y < self.righttop.y
 
+    def contains(self, points: PointArray) -> np.ndarray:
+        """Get which of points are in the rect."""
+        return (points.x > self.leftbottom.x) & \
+            (points.x < self.righttop.x) & \
+            (points.y > self.leftbottom.y) & (points.y < self.righttop.y)
+
     def __add__(self, shift: Point) -> Rect:
         return Rect(self.leftbottom + shift, self.righttop + shift)
 
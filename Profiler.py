@@ -0,0 +1,234 @@
+from __future__ import annotations
+from functools import partialmethod, wraps
+from typing import Callable, Dict, List, Optional, Tuple
+import json
+import math
+import os
+import time
+
+import Renderer
+from Actor import Actor, Callback
+from Encoder import VideoEncoder
+from Renderer import Recorder, RenderPool
+
+
+class Stat:
+    """Wall times of the calls of a stage, in nanoseconds, with a histogram
+    by powers of 2 microseconds."""
+    hist: Dict[int, int]
+
+    def __init__(self) -> None:
+        self.calls = 0
+        self.total = 0
+        # Not counting the stages called by this one
+        self.self_total = 0
+        self.max = 0
+        self.artists = 0
+        self.hist = {}
+
+    def add(self, duration: int, self_duration: int, artists: int) -> None:
+        self.calls += 1
+        self.total += duration
+        self.self_total += self_duration
+        self.max = max(self.max, duration)
+        self.artists += artists
+        bucket = max(0, math.ceil(math.log2(max(duration, 1) / 1000)))
+        self.hist[bucket] = self.hist.get(bucket, 0) + 1
+
+    def percentile(self, q: float) -> float:
+        """Get the upper bound in microseconds of the bucket of the q
+        quantile."""
+        cnt = 0
+        for bucket in sorted(self.hist):
+            cnt += self.hist[bucket]
+            if cnt >= q * self.calls:
+                return 2 ** bucket
+        return math.inf
+
+
+class Profiler:
+    """Times the stages of Scene.run: stepping and plotting the scene, each
+    step and plot of the actors, each step of the callbacks, and rendering
+    and encoding the frames.
+
+    Stages are timed by wrapping their methods between begin() and end(),
+    so a run without profiler costs nothing more. Times are summed by the
+    class of the actors, and by their name too if they have one, along with
+    the artists they draw. Each run is written as a Chrome trace to
+    trace_dir, which Perfetto opens too. Frames rendered by the worker
+    processes of RenderPool are not timed, only the ones rendered in the
+    current process.
+    """
+    stats: Dict[str, Stat]
+    # Object and stage of the calls being timed, with the time spent in
+    # the stages they called, and the artists they drew
+    stack: List[list]
+
+    # Stages, by the methods they are timed by
+    ACTOR_METHODS = ("step", "dormant_step", "_plot")
+    CALLBACK_METHODS = ("step",)
+    SCENE_METHODS = ("step", "plot", "snapshot")
+    RENDER_METHODS = {RenderPool: ("submit", "hold"),
+                      VideoEncoder: ("write", "repeat", "close")}
+    RENDER_FUNCTIONS = ("_render_frame",)
+
+    # Trace events kept by run, the later ones are only summed
+    MAX_EVENTS = 1000000
+
+    def __init__(self, trace_dir: str = None) -> None:
+        self.trace_dir = trace_dir
+        self.name = None
+        self.stats = {}
+        self.stack = []
+        self.events = []
+        self.start = 0
+        self.patched = []
+
+    def begin(self, scene: Scene) -> None:
+        """Start timing a run of scene."""
+        # In case the last run raised before end()
+        self._unpatch()
+        self.name = scene.name
+        self.stats = {}
+        self.events = []
+        self.start = time.perf_counter_ns()
+
+        for cls in subclasses(Actor):
+            self._patch(cls, self.ACTOR_METHODS)
+        for cls in subclasses(Callback):
+            self._patch(cls, self.CALLBACK_METHODS)
+        self._patch(type(scene), self.SCENE_METHODS)
+        for cls, methods in self.RENDER_METHODS.items():
+            self._patch(cls, methods)
+        for func in self.RENDER_FUNCTIONS:
+            self._patch(Renderer, (func,), method=False)
+
+        # Recorded calls are the artists drawn by the frame
+        for method, value in list(vars(Recorder).items()):
+            if isinstance(value, partialmethod):
+                self.patched.append((Recorder, method, value))
+                setattr(Recorder, method, self._count(method))
+
+    def end(self) -> None:
+        """Stop timing, and write the trace of the run."""
+        self._unpatch()
+        if self.trace_dir:
+            os.makedirs(self.trace_dir, exist_ok=True)
+            with open(self.get_filename(), "w") as f:
+                json.dump({"traceEvents": self.events,
+                           "displayTimeUnit": "ms"}, f)
+
+    def _unpatch(self) -> None:
+        for owner, name, value in reversed(self.patched):
+            setattr(owner, name, value)
+        self.patched = []
+        self.stack = []
+
+    def get_filename(self) -> str:
+        return os.path.join(self.trace_dir, f"{self.name}.trace.json")
+
+    def _patch(self, owner: type, names: Tuple[str], method: bool = True
+               ) -> None:
+        # Only the methods defined by owner, the inherited ones are patched
+        # with the classes defining them
+        for name in names:
+            func = vars(owner).get(name)
+            if func is None:
+                continue
+            self.patched.append((owner, name, func))
+            setattr(owner, name, self._wrap(func, name, method))
+
+    def _wrap(self, func: Callable, stage: str, method: bool) -> Callable:
+        profiler = self
+        if not method:
+            @wraps(func)
+            def wrapper(*args, **kwargs):
+                return profiler._call(func, None, stage, args, kwargs)
+            return wrapper
+
+        @wraps(func)
+        def wrapper(obj, *args, **kwargs):
+            return profiler._call(func, obj, stage, (obj, *args), kwargs)
+        return wrapper
+
+    def _count(self, method: str) -> Callable:
+        profiler = self
+        record = Recorder._record
+
+        def wrapper(recorder, *args, **kwargs):
+            if profiler.stack:
+                profiler.stack[-1][3] += 1
+            return record(recorder, method, *args, **kwargs)
+        return wrapper
+
+    def _call(self, func: Callable, obj: object, stage: str, args: tuple,
+              kwargs: dict) -> object:
+        stack = self.stack
+        # Methods calling the ones they override are timed once
+        if stack and stack[-1][0] is obj and stack[-1][1] == stage and \
+                obj is not None:
+            return func(*args, **kwargs)
+
+        frame = [obj, stage, 0, 0]
+        stack.append(frame)
+        start = time.perf_counter_ns()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            duration = time.perf_counter_ns() - start
+            stack.pop()
+            if stack:
+                stack[-1][2] += duration
+            self._add(obj, stage, start, duration, duration - frame[2],
+                      frame[3])
+
+    def _add(self, obj: Optional[object], stage: str, start: int,
+             duration: int, self_duration: int, artists: int) -> None:
+        labels = [get_label(obj, stage)]
+        if isinstance(obj, Actor) and obj.name:
+            labels.append(get_label(obj, stage, obj.name))
+        for label in labels:
+            stat = self.stats.get(label)
+            if stat is None:
+                stat = self.stats[label] = Stat()
+            stat.add(duration, self_duration, artists)
+
+        if len(self.events) < self.MAX_EVENTS:
+            event = {"name": labels[-1], "ph": "X", "pid": os.getpid(),
+                     "tid": 0, "ts": (start - self.start) / 1000,
+                     "dur": duration / 1000,
+                     "cat": "actor" if isinstance(obj, Actor) else
+                     "callback" if isinstance(obj, Callback) else "scene"}
+            if artists:
+                event["args"] = {"artists": artists}
+            self.events.append(event)
+
+    def __str__(self) -> str:
+        """Get a table of the stages, the most time consuming first."""
+        rows = [f"{'stage':<40} {'calls':>7} {'total ms':>9} {'self ms':>9} "
+                f"{'mean us':>8} {'p50 us':>7} {'p95 us':>7} {'max us':>8} "
+                f"{'artists':>7}"]
+        for label, stat in sorted(self.stats.items(),
+                                  key=lambda item: -item[1].self_total):
+            rows.append(
+                f"{label:<40.40} {stat.calls:>7} {stat.total / 1e6:>9.1f} "
+                f"{stat.self_total / 1e6:>9.1f} "
+                f"{stat.total / stat.calls / 1e3:>8.1f} "
+                f"{stat.percentile(.5):>7} {stat.percentile(.95):>7} "
+                f"{stat.max / 1e3:>8.1f} {stat.artists:>7}")
+        return "\n".join(rows)
+
+
+def subclasses(cls: type) -> List[type]:
+    """Get cls and all its subclasses."""
+    classes = [cls]
+    for sub in cls.__subclasses__():
+        classes.extend(c for c in subclasses(sub) if c not in classes)
+    return classes
+
+
+def get_label(obj: Optional[object], stage: str, name: str = None) -> str:
+    if obj is None:
+        return stage
+    cls = type(obj).__name__
+    return f"{cls}[{name}].{stage}" if name else f"{cls}.{stage}"
@@ -0,0 +1,110 @@
+from __future__ import annotations
+from multiprocessing.connection import wait
+from typing import Callable, Dict, List, Tuple
+import multiprocessing
+import os
+
+from Scene import Scene
+
+
+class RenderJobs:
+    """Renders scenes at the same time, each in its own process, sharing one
+    budget of render workers.
+
+    A job is a function building and running scenes, like scene1(). Jobs
+    are started as long as they can get at least MIN_WORKERS workers each,
+    and share the budget by their weights. The others wait for running jobs
+    to end, and take their workers. Frames are streamed to ffmpeg as they
+    are rendered, so encoding the end of a scene overlaps with rendering
+    the others.
+
+    The budget is all the CPUs, and no more workers than fit in memory,
+    counting WORKER_MEMORY bytes for each. setup is called at the start of
+    every job process, for the settings of Scene and TextureStore.
+    """
+    jobs: List[Tuple[Callable, tuple, dict, float]]
+
+    # Bytes taken by a render worker, about
+    WORKER_MEMORY = 512 * 2**20
+    MIN_WORKERS = 2
+
+    def __init__(self, workers: int = None, memory: int = None,
+                 setup: Callable[[], None] = None) -> None:
+        self.workers = workers if workers else os.cpu_count()
+        self.memory = memory if memory else get_memory()
+        if self.memory:
+            self.workers = min(self.workers,
+                               max(1, self.memory // self.WORKER_MEMORY))
+        self.setup = setup
+        self.jobs = []
+
+    def submit(self, func: Callable, *args, weight: float = 1,
+               **kwargs) -> None:
+        """Add a job calling func(*args, **kwargs), whose share of the
+        workers is proportional to weight."""
+        self.jobs.append((func, args, kwargs, weight))
+
+    def _shares(self, weights: List[float], workers: int) -> List[int]:
+        # Every job gets MIN_WORKERS, or all the workers of a lone job when
+        # there are fewer, and the rest is split by weight
+        base = max(1, min(self.MIN_WORKERS, workers // len(weights)))
+        rest = max(0, workers - base * len(weights))
+        total = sum(weights)
+        exact = [rest * w / total for w in weights]
+        shares = [base + int(e) for e in exact]
+        # Workers left by the rounding go to the largest remainders
+        left = workers - sum(shares)
+        for i in sorted(range(len(weights)),
+                        key=lambda i: int(exact[i]) - exact[i])[:left]:
+            shares[i] += 1
+        return shares
+
+    def run(self) -> None:
+        """Run all the jobs, and wait for them to end."""
+        waiting = list(self.jobs)
+        self.jobs = []
+        running: Dict[int, Tuple[multiprocessing.Process, int]] = {}
+        free = self.workers
+        failed = []
+
+        while waiting or running:
+            # Start as many jobs as the free workers allow
+            cnt = min(len(waiting), max(1, free // self.MIN_WORKERS)) \
+                if free >= self.MIN_WORKERS or not running else 0
+            if cnt:
+                started, waiting = waiting[:cnt], waiting[cnt:]
+                shares = self._shares([job[3] for job in started], free)
+                for job, workers in zip(started, shares):
+                    process = multiprocessing.Process(
+                        target=_run_job, args=(job[:3], workers, self.setup),
+                        name=getattr(job[0], "__name__", "job"))
+                    process.start()
+                    running[process.sentinel] = (process, workers)
+                    free -= workers
+
+            for sentinel in wait(list(running)):
+                process, workers = running.pop(sentinel)
+                process.join()
+                free += workers
+                if process.exitcode != 0:
+                    failed.append(process.name)
+
+        if failed:
+            raise Exception(f"Render jobs failed: {', '.join(failed)}")
+
+
+def _run_job(job: Tuple[Callable, tuple, dict], workers: int,
+             setup: Callable[[], None]) -> None:
+    if setup:
+        setup()
+    Scene.workers = workers
+    func, args, kwargs = job
+    func(*args, **kwargs)
+
+
+def get_memory() -> int:
+    """Get the bytes of physical memory, or None if unknown."""
+    try:
+        return os.sysconf("SC_PHYS_PAGES") * os.sysconf("SC_PAGE_SIZE")
+    except (AttributeError, ValueError, OSError):
+        return None
@@ -0,0 +1,690 @@
+from __future__ import annotations
+from collections import OrderedDict, deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from functools import partialmethod
+from typing import Deque, Dict, Hashable, List, Optional, Tuple
+import math
+import os
+import pickle
+import shutil
+import time
+from matplotlib.artist import Artist
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
+from matplotlib.image import imsave
+from matplotlib.patches import PathPatch, Rectangle, Polygon
+from matplotlib.path import Path
+import numpy as np
+
+from Encoder import VideoEncoder
+from FrameCache import FrameCache
+from Point import Point, Rect
+
+
+class Renderer:
+    """Retained-mode drawing surface of a scene.
+
+    Actors ask for artists by key. The first request creates the artist, later
+    requests only update its data. Artists that are not requested during a
+    frame are hidden.
+
+    World-fixed actors can be drawn into background tiles instead, one view
+    wide. Tiles are rasterized once, and each frame copies its slice of them
+    into the canvas before drawing the other artists on top. Actors fixed on
+    the screen can be drawn into a HUD layer, which is only rasterized again
+    when it changes, and is blended over the frame.
+    """
+    artists: Dict[Hashable, Artist]
+    tiles: OrderedDict[bytes, np.ndarray]
+
+    # Rows of the blocks the HUD layer is blended by, skipping empty ones
+    HUD_BLOCK = 64
+
+    # Tiles kept rasterized, the least recently used ones are dropped
+    MAX_TILES = 4
+
+    # Added to the zorder of every draw call, so that artists with the same
+    # zorder are drawn in the order the actors asked for them.
+    ZORDER_STEP = 1e-7
+
+    def __init__(self, fig_size: Tuple[int, int] = (16, 12), dpi: int = 100,
+                 debug: bool = False) -> None:
+        self.fig = Figure(figsize=fig_size, dpi=dpi)
+        self.canvas = FigureCanvasAgg(self.fig)
+        self.ax = self.fig.add_subplot()
+        for spine in self.ax.spines.values():
+            spine.set_visible(False)
+        if not debug:
+            self.ax.get_yaxis().set_visible(False)
+            self.ax.get_xaxis().set_visible(False)
+        self.debug = debug
+        self.laid_out = False
+        self.pixels_per_unit = None
+
+        self.artists = {}
+        self.styles = {}
+        self.zorders = {}
+        self.sources = {}
+        self.drawn = []
+        self.view = None
+
+        self.tiles = OrderedDict()
+        self.tile_renderer = None
+        # Tiles under the frame, and how many pixels it is past the first
+        self.background = None
+
+        self.hud_renderer = None
+        # Key and blocks of the last HUD layer
+        self.hud = None
+        # Blocks of the HUD layer over the frame
+        self.overlay = None
+
+    def warm_up(self) -> None:
+        """Load the fonts of Matplotlib and lay out a text once, which the
+        first frame would otherwise wait for."""
+        text = self.ax.text(0, 0, "0")
+        self.canvas.draw()
+        text.remove()
+
+    def begin(self, view: Rect, title: str = None) -> None:
+        self.view = view
+        self.ax.set_xlim(view.leftbottom.x, view.righttop.x)
+        self.ax.set_ylim(view.leftbottom.y, view.righttop.y)
+        self.pixels_per_unit = pixels_per_unit(
+            view, self.fig.get_size_inches(), self.fig.dpi)
+        if title is not None:
+            self.ax.set_title(title)
+        self.drawn = []
+
+    def end(self) -> None:
+        drawn = set(self.drawn)
+        for key, artist in self.artists.items():
+            artist.set_visible(key in drawn)
+
+        if not self.debug and not self.laid_out:
+            self.fig.tight_layout(pad=0)
+            self.laid_out = True
+
+    def render(self, snapshot: Snapshot) -> None:
+        self.begin(snapshot.view, snapshot.title)
+        for method, key, args, kwargs in snapshot.calls:
+            getattr(self, method)(key, *args, **kwargs)
+        self.end()
+
+        self.background = None
+        if snapshot.tiles:
+            tiles = [self._get_tile(view, calls)
+                     for view, calls in snapshot.tiles]
+            first = snapshot.tiles[0][0]
+            shift = (snapshot.view.leftbottom.x - first.leftbottom.x) / \
+                (first.righttop.x - first.leftbottom.x)
+            self.background = (tiles, shift)
+
+        self.overlay = None
+        if snapshot.hud is not None:
+            self.overlay = self._get_hud(*snapshot.hud)
+
+    def _get_layout(self) -> tuple:
+        # Images make the aspect of the axes equal, which layers have to
+        # follow to be laid out the same
+        return (self.ax.get_aspect(), self.ax.get_adjustable(),
+                tuple(self.ax.get_position(original=True).bounds))
+
+    def _new_layer(self, transparent: bool = False) -> Renderer:
+        """Get a renderer for a layer of the frames."""
+        layer = Renderer(tuple(self.fig.get_size_inches()), self.fig.dpi)
+        layer.laid_out = True
+        if transparent:
+            layer.fig.patch.set_visible(False)
+            layer.ax.patch.set_visible(False)
+        return layer
+
+    def _render_layer(self, layer: Renderer, layout: tuple, view: Rect,
+                      calls: list) -> np.ndarray:
+        snapshot = Snapshot(view)
+        snapshot.calls = calls
+        layer.render(snapshot)
+        # After the calls, as images set the aspect of the axes again
+        layer.ax.set_aspect(layout[0], adjustable=layout[1])
+        layer.ax.set_position(layout[2])
+        return np.array(layer.buffer_rgba())
+
+    def _get_hud(self, view: Rect, calls: list) -> List[tuple]:
+        """Get the blocks of rows and columns the HUD layer draws in, with
+        their terms to blend by."""
+        layout = self._get_layout()
+        key = pickle.dumps((view, calls, layout), pickle.HIGHEST_PROTOCOL)
+        if self.hud is not None and self.hud[0] == key:
+            return self.hud[1]
+
+        if self.hud_renderer is None:
+            self.hud_renderer = self._new_layer(transparent=True)
+        pixels = self._render_layer(self.hud_renderer, layout, view, calls)
+
+        blocks = []
+        for top in range(0, pixels.shape[0], self.HUD_BLOCK):
+            block = pixels[top:top + self.HUD_BLOCK]
+            cols = np.flatnonzero(block[..., 3].any(axis=0))
+            if cols.size:
+                left, right = int(cols[0]), int(cols[-1]) + 1
+                blocks.append((slice(top, top + self.HUD_BLOCK),
+                               slice(left, right),
+                               *blend_terms(block[:, left:right])))
+
+        self.hud = (key, blocks)
+        return blocks
+
+    def _get_tile(self, view: Rect, calls: list
+                  ) -> Tuple[np.ndarray, Tuple[int, int]]:
+        """Get the pixels of a background tile, and the columns of its
+        axes."""
+        layout = self._get_layout()
+        key = pickle.dumps((view, calls, layout), pickle.HIGHEST_PROTOCOL)
+        tile = self.tiles.get(key)
+        if tile is not None:
+            self.tiles.move_to_end(key)
+            return tile
+
+        if self.tile_renderer is None:
+            self.tile_renderer = self._new_layer()
+        pixels = self._render_layer(self.tile_renderer, layout, view, calls)
+        extent = self.tile_renderer.ax.get_window_extent()
+        tile = (pixels, (round(extent.x0), round(extent.x1)))
+
+        self.tiles[key] = tile
+        if len(self.tiles) > self.MAX_TILES:
+            self.tiles.popitem(last=False)
+        return tile
+
+    def plot_static(self, actor: Actor) -> None:
+        actor.plot(self)
+
+    def plot_hud(self, actor: Actor) -> None:
+        actor.plot(self)
+
+    def savefig(self, filename: str) -> None:
+        if self.background is None and self.overlay is None:
+            self.fig.savefig(filename)
+        else:
+            imsave(filename, np.asarray(self.buffer_rgba()))
+
+    def buffer_rgba(self) -> memoryview:
+        """Draw the frame and get the RGBA buffer of the canvas. The buffer
+        is overwritten by the next frame."""
+        if self.background is None:
+            self.canvas.draw()
+        else:
+            self._draw_over_tiles()
+
+        if self.overlay is not None:
+            buffer = np.asarray(self.canvas.buffer_rgba())
+            for rows, cols, src, alpha in self.overlay:
+                blend(buffer[rows, cols], src, alpha)
+        return self.canvas.buffer_rgba()
+
+    def _draw_over_tiles(self) -> None:
+        renderer = self.canvas.get_renderer()
+        buffer = np.asarray(renderer.buffer_rgba())
+        ((first, (left, right)), (second, _)), shift = self.background
+        shift = round(shift * (right - left))
+        buffer[:] = first
+        buffer[:, left:right - shift] = first[:, left + shift:right]
+        buffer[:, right - shift:right] = second[:, left:left + shift]
+
+        # Without the backgrounds of the figure and the axes, which would
+        # cover the tiles
+        self.fig.patch.set_visible(False)
+        self.ax.patch.set_visible(False)
+        try:
+            self.fig.draw(renderer)
+        finally:
+            self.fig.patch.set_visible(True)
+            self.ax.patch.set_visible(True)
+
+    def _reuse(self, key: Hashable, style: dict) -> Artist:
+        """Get the artist of key if it can be updated to style in place."""
+        artist = self.artists.get(key)
+        if artist is None:
+            return None
+
+        old_style = self.styles[key]
+        if old_style != style:
+            changed = {k for k in old_style.keys() | style.keys()
+                       if old_style.get(k) != style.get(k)}
+            if changed == {"color"} and "color" in style:
+                artist.set_color(style["color"])
+                self.styles[key] = dict(style)
+            else:
+                self.remove(key)
+                return None
+        return artist
+
+    def _add(self, key: Hashable, artist: Artist, style: dict) -> None:
+        self.artists[key] = artist
+        self.styles[key] = dict(style)
+        self.zorders[key] = artist.get_zorder()
+
+    def _draw(self, key: Hashable) -> None:
+        self.artists[key].set_zorder(
+            self.zorders[key] + len(self.drawn) * self.ZORDER_STEP)
+        self.drawn.append(key)
+
+    def remove(self, key: Hashable) -> None:
+        self.artists.pop(key).remove()
+        self.styles.pop(key)
+        self.zorders.pop(key)
+        self.sources.pop(key, None)
+
+    def line(self, key: Hashable, X: List[float], Y: List[float],
+             alpha: float = None, **style) -> None:
+        line = self._reuse(key, style)
+        if line is None:
+            line, = self.ax.plot(X, Y, alpha=alpha, **style)
+            self._add(key, line, style)
+        else:
+            line.set_data(X, Y)
+            line.set_alpha(alpha)
+        self._draw(key)
+
+    def scatter(self, key: Hashable, X: List[float], Y: List[float],
+                s: float = None, alpha: float = None, **style) -> None:
+        """s and alpha are either the same for all the points, or arrays of
+        one value per point."""
+        collection = self._reuse(key, style)
+        if collection is not None and np.iterable(collection.get_alpha()) \
+                and not np.iterable(alpha):
+            # matplotlib can't set a single alpha over an array of alphas
+            self.remove(key)
+            collection = None
+        if collection is None:
+            collection = self.ax.scatter(X, Y, s=s, alpha=alpha, **style)
+            self._add(key, collection, style)
+        else:
+            collection.set_offsets(np.column_stack([X, Y]))
+            if s is not None:
+                collection.set_sizes(np.atleast_1d(s))
+            collection.set_alpha(alpha)
+        self._draw(key)
+
+    def arrow(self, key: Hashable, x: float, y: float, dx: float, dy: float,
+              alpha: float = None, **style) -> None:
+        arrow = self._reuse(key, style)
+        if arrow is None:
+            arrow = self.ax.arrow(x, y, dx, dy, alpha=alpha, **style)
+            self._add(key, arrow, style)
+        else:
+            arrow.set_data(x=x, y=y, dx=dx, dy=dy)
+            arrow.set_alpha(alpha)
+        self._draw(key)
+
+    def text(self, key: Hashable, x: float, y: float, s: str,
+             alpha: float = None, bbox: dict = None, **style) -> None:
+        text = self._reuse(key, style)
+        if text is None:
+            text = self.ax.text(x, y, s, alpha=alpha, bbox=bbox, **style)
+            text.set_in_layout(False)
+            self._add(key, text, style)
+        else:
+            text.set_position((x, y))
+            text.set_text(s)
+            text.set_alpha(alpha)
+            self._update_bbox(text, self.sources.get(key), bbox)
+        self.sources[key] = bbox
+        self._draw(key)
+
+    def _update_bbox(self, text: Artist, old: dict, new: dict) -> None:
+        if old == new:
+            return
+        if old and new and old.keys() == new.keys() and \
+                all(old[k] == new[k] for k in old if k != "alpha"):
+            text.get_bbox_patch().set_alpha(new["alpha"])
+        else:
+            text.set_bbox(new)
+
+    def rectangle(self, key: Hashable, x: float, y: float, w: float, h: float,
+                  **style) -> None:
+        rect = self._reuse(key, style)
+        if rect is None:
+            rect = Rectangle((x, y), w, h, **style)
+            self.ax.add_patch(rect)
+            self._add(key, rect, style)
+        else:
+            rect.set_bounds(x, y, w, h)
+        self._draw(key)
+
+    def rectangles(self, key: Hashable, rects: np.ndarray, **style) -> None:
+        """Draw rects, rows of x, y, w, h, as one path. The path is only
+        built again when rects change."""
+        patch = self._reuse(key, style)
+        if patch is None:
+            # Without edges by default, like Rectangle
+            patch = PathPatch(rects_to_path(rects),
+                              **{"edgecolor": "none", **style})
+            self.ax.add_patch(patch)
+            self._add(key, patch, style)
+        else:
+            source = self.sources[key]
+            if rects is not source and not np.array_equal(rects, source):
+                patch.set_path(rects_to_path(rects))
+        self.sources[key] = rects
+        self._draw(key)
+
+    def polygon(self, key: Hashable, xy: np.ndarray, alpha: float = None,
+                **style) -> None:
+        polygon = self._reuse(key, style)
+        if polygon is None:
+            polygon = Polygon(xy, alpha=alpha, **style)
+            self.ax.add_patch(polygon)
+            self._add(key, polygon, style)
+        else:
+            polygon.set_xy(xy)
+            polygon.set_alpha(alpha)
+        self._draw(key)
+
+    def image(self, key: Hashable, img: np.ndarray,
+              extent: Tuple[float, float, float, float], **style) -> None:
+        image = self._reuse(key, style)
+        if image is None:
+            image = self.ax.imshow(img, extent=extent, **style)
+            self._add(key, image, style)
+        else:
+            if img is not self.sources[key]:
+                image.set_data(img)
+            image.set_extent(extent)
+        self.sources[key] = img
+        self._draw(key)
+
+
+def rects_to_path(rects: np.ndarray) -> Path:
+    """Get the path of rects, rows of x, y, w, h, drawn like Rectangles."""
+    x, y, w, h = np.asarray(rects, dtype=float).reshape(-1, 4).T
+    vertices = np.stack([np.column_stack([x, y]),
+                         np.column_stack([x + w, y]),
+                         np.column_stack([x + w, y + h]),
+                         np.column_stack([x, y + h]),
+                         np.column_stack([x, y])], axis=1)
+    codes = np.tile([Path.MOVETO, Path.LINETO, Path.LINETO, Path.LINETO,
+                     Path.CLOSEPOLY], len(rects))
+    return Path(vertices.reshape(-1, 2), codes)
+
+
+def blend_terms(pixels: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Get the terms to blend the straight alpha RGBA pixels by: their RGB
+    times their alpha, rounded, and 255 minus their alpha."""
+    alpha = pixels[..., 3:].astype(np.uint16)
+    return pixels[..., :3] * alpha + 128, 255 - alpha
+
+
+def blend(dst: np.ndarray, src: np.ndarray, alpha: np.ndarray) -> None:
+    """Blend pixels over the opaque RGBA pixels dst in place, by their
+    blend_terms."""
+    rgb = dst[..., :3] * alpha
+    rgb += src
+    # Divides by 255, exactly for these values
+    rgb += rgb >> 8
+    rgb >>= 8
+    dst[..., :3] = rgb
+
+
+def get_tiles(view: Rect) -> List[Rect]:
+    """Get the background tiles under view. Tiles are as wide as view, and
+    start at multiples of its width."""
+    width = view.righttop.x - view.leftbottom.x
+    first = math.floor(view.leftbottom.x / width)
+    return [Rect(Point(i * width, view.leftbottom.y),
+                 Point((i + 1) * width, view.righttop.y))
+            for i in (first, first + 1)]
+
+
+def pixels_per_unit(view: Rect, fig_size: Tuple[float, float],
+                    dpi: float) -> float:
+    """Get the output pixels per world unit, when view fills the figure with
+    an equal aspect ratio."""
+    size = view.righttop - view.leftbottom
+    return min(fig_size[0] * dpi / size.x, fig_size[1] * dpi / size.y)
+
+
+class Snapshot:
+    """Draw state of one frame, which can be rendered in any process."""
+    calls: List[Tuple[str, Hashable, tuple, dict]]
+    # Views and calls of the background tiles under the frame
+    tiles: List[Tuple[Rect, List[Tuple[str, Hashable, tuple, dict]]]]
+    # View and calls of the HUD layer over the frame, or None
+    hud: Tuple[Rect, List[Tuple[str, Hashable, tuple, dict]]]
+
+    def __init__(self, view: Rect, title: str = None) -> None:
+        self.view = view
+        self.title = title
+        self.calls = []
+        self.tiles = []
+        self.hud = None
+
+
+class Recorder:
+    """Takes the drawing calls of actors like a Renderer, but only records
+    them into a snapshot."""
+    snapshot: Snapshot
+
+    def __init__(self, view: Rect, title: str = None,
+                 pixels_per_unit: float = None, layered: bool = False
+                 ) -> None:
+        self.snapshot = Snapshot(view, title)
+        self.view = view
+        self.pixels_per_unit = pixels_per_unit
+
+        self.tiles = None
+        self.hud = None
+        if layered:
+            self.tiles = [Recorder(tile, pixels_per_unit=pixels_per_unit)
+                          for tile in get_tiles(view)]
+            self.snapshot.tiles = [(tile.view, tile.snapshot.calls)
+                                   for tile in self.tiles]
+            # Drawn from the origin, so that the calls stay the same while
+            # the view moves
+            self.hud = Recorder(Rect(Point(0, 0), view.righttop -
+                                     view.leftbottom), None, pixels_per_unit)
+            self.snapshot.hud = (self.hud.view, self.hud.snapshot.calls)
+
+    def plot_static(self, actor: Actor) -> None:
+        """Plot a world-fixed actor, which draws the same whatever the time,
+        into the background tiles, under all the other actors."""
+        if self.tiles is None:
+            actor.plot(self)
+        else:
+            for tile in self.tiles:
+                actor.plot(tile)
+
+    def plot_hud(self, actor: Actor) -> None:
+        """Plot an actor fixed on the screen, which draws relative to the
+        left bottom of the view, into the HUD layer, over all the other
+        actors."""
+        if self.hud is None:
+            actor.plot(self)
+        else:
+            actor.plot(self.hud)
+
+    def _record(self, method: str, key: Hashable, *args, **kwargs) -> None:
+        self.snapshot.calls.append((method, key, args, kwargs))
+
+    line = partialmethod(_record, "line")
+    scatter = partialmethod(_record, "scatter")
+    arrow = partialmethod(_record, "arrow")
+    text = partialmethod(_record, "text")
+    rectangle = partialmethod(_record, "rectangle")
+    rectangles = partialmethod(_record, "rectangles")
+    polygon = partialmethod(_record, "polygon")
+    image = partialmethod(_record, "image")
+
+
+# Renderer of a worker process of RenderPool
+_worker_renderer: Renderer = None
+
+
+def _init_worker(fig_size: Tuple[int, int], dpi: int, debug: bool) -> None:
+    global _worker_renderer
+    _worker_renderer = Renderer(fig_size, dpi, debug)
+    _worker_renderer.warm_up()
+
+
+def _render_frame(renderer: Renderer, snapshot: Snapshot, filename: str,
+                  cache_file: str) -> Optional[memoryview]:
+    renderer.render(snapshot)
+    if filename is not None:
+        renderer.savefig(filename)
+        if cache_file is not None:
+            FrameCache.save_file(cache_file, filename)
+        return None
+
+    frame = renderer.buffer_rgba()
+    if cache_file is not None:
+        FrameCache.save(cache_file, frame)
+    return frame
+
+
+def _render_chunk(frames: List[Tuple[Snapshot, str, str]]
+                  ) -> List[Optional[np.ndarray]]:
+    rgba_frames = []
+    for snapshot, filename, cache_file in frames:
+        if snapshot is not None:
+            frame = _render_frame(_worker_renderer, snapshot, filename,
+                                  cache_file)
+            frame = None if frame is None else np.array(frame)
+        elif filename is None and os.path.isfile(cache_file):
+            # Decoded here in parallel. Frames that are still being rendered
+            # by other workers are read by RenderPool later.
+            frame = FrameCache.load(cache_file)
+        else:
+            frame = None
+        rgba_frames.append(frame)
+    return rgba_frames
+
+
+class RenderPool:
+    """Renders snapshots with a pool of worker processes.
+
+    A frame submitted with a filename is saved to that file, otherwise its raw
+    RGBA buffer is written to the encoder, in the order of submission.
+    Snapshots are sent to the workers in chunks, so that images shared by the
+    frames of a chunk are only pickled once. With at most one worker, frames
+    are rendered in the current process.
+
+    Rendered frames are also saved to their cache_file if given. A frame
+    submitted without snapshot is read from its cache_file instead, which
+    has to be written by the time the frames before it are collected.
+
+    hold() repeats the last submitted frame without rendering or encoding it
+    again: its buffer is written to the encoder again, or its file is hard
+    linked.
+    """
+    pending: Deque[Tuple[Future, list]]
+    holds: Dict[int, Tuple[int, List[str]]]
+
+    def __init__(self, workers: int, fig_size: Tuple[int, int] = (16, 12),
+                 dpi: int = 100, debug: bool = False,
+                 encoder: VideoEncoder = None, chunk_size: int = 8) -> None:
+        self.workers = workers
+        self.encoder = encoder
+        self.chunk_size = chunk_size
+        self.chunk = []
+        self.pending = deque()
+        self.submitted = 0
+        self.written = 0
+        self.holds = {}
+        self.last_filename = None
+        # perf_counter() when the first frame was output
+        self.first_frame_time = None
+
+        if self.workers > 1:
+            self.renderer = None
+            self.executor = ProcessPoolExecutor(
+                self.workers, initializer=_init_worker,
+                initargs=(fig_size, dpi, debug))
+        else:
+            self.renderer = Renderer(fig_size, dpi, debug)
+            self.renderer.warm_up()
+            self.executor = None
+
+    def __enter__(self) -> RenderPool:
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def submit(self, snapshot: Snapshot, filename: str = None,
+               cache_file: str = None) -> None:
+        self.submitted += 1
+        if self.executor is None:
+            frame = None
+            if snapshot is not None:
+                frame = _render_frame(self.renderer, snapshot, filename,
+                                      cache_file)
+            self._output(frame, snapshot, filename, cache_file)
+            return
+
+        self.chunk.append((snapshot, filename, cache_file))
+        if len(self.chunk) >= self.chunk_size:
+            self._flush()
+
+    def _output(self, frame: Optional[memoryview], snapshot: Snapshot,
+                filename: str, cache_file: str) -> None:
+        if snapshot is None and filename is None:
+            if frame is None:
+                frame = FrameCache.load(cache_file)
+            self.encoder.write(frame)
+        elif snapshot is None:
+            shutil.copy(cache_file, filename)
+        elif filename is None:
+            self.encoder.write(frame)
+
+        self.last_filename = filename
+        if self.first_frame_time is None:
+            self.first_frame_time = time.perf_counter()
+        self.written += 1
+        if self.written - 1 in self.holds:
+            self._repeat(*self.holds.pop(self.written - 1))
+
+    def hold(self, cnt: int, filenames: List[str] = None) -> None:
+        """Repeat the last submitted frame cnt times, into the encoder or as
+        the files of filenames."""
+        assert self.submitted > 0, "No frame to hold!"
+        if self.written == self.submitted:
+            self._repeat(cnt, filenames)
+        else:
+            self.holds[self.submitted - 1] = (cnt, filenames)
+
+    def _repeat(self, cnt: int, filenames: List[str] = None) -> None:
+        if filenames is None:
+            self.encoder.repeat(cnt)
+            return
+
+        for filename in filenames:
+            try:
+                os.link(self.last_filename, filename)
+            except OSError:
+                shutil.copy(self.last_filename, filename)
+
+    def _flush(self) -> None:
+        if not self.chunk:
+            return
+
+        # Limit the snapshots waiting in memory
+        while len(self.pending) >= 2 * self.workers:
+            self._collect(*self.pending.popleft())
+        self.pending.append(
+            (self.executor.submit(_render_chunk, self.chunk), self.chunk))
+        self.chunk = []
+
+    def _collect(self, future: Future, chunk: list) -> None:
+        # Cached frames are read here, after the frames of earlier chunks
+        # were saved to the cache
+        for frame, args in zip(future.result(), chunk):
+            self._output(frame, *args)
+
+    def close(self) -> None:
+        if self.executor is None:
+            return
+
+        self._flush()
+        while self.pending:
+            self._collect(*self.pending.popleft())
+        self.executor.shutdown()
@@ -1,20 +1,28 @@
 #! /bin/env python3
 
 from __future__ import annotations
-from alive_progress import alive_bar
-from typing import List, Tuple
-import matplotlib.pyplot as plt
-from matplotlib.figure import Figure
+from contextlib import nullcontext
+from typing import TYPE_CHECKING, Dict, List, Tuple
+import multiprocessing
 import os
 import shutil
-import threading
+import subprocess
+import sys
 import time
 
-plt.rcParams.update({'figure.max_open_warning': 0})
+import numpy as np
 
-from Actor import *
-from Controller import *
-from Point import *
+from Actor import Actor, ActorList, Car
+from Checkpoint import Checkpoint, CheckpointDir
+from Point import Point, Rect
+from Encoder import VideoEncoder
+
+# Matplotlib and the progress bar are imported once frames are rendered, so
+# that scenes can be built and stepped without them
+if TYPE_CHECKING:
+    from FrameCache import FrameCache
+    from Profiler import Profiler
+    from Renderer import RenderPool, Snapshot
 
 
 class Camera:
@@ -33,9 +41,8 @@ class Camera:
 
     def _follow_ego_x(self) -> None:
         def get_view(self, ego: Car) -> Rect:
-            ego_pos = copy.deepcopy(ego.pos)
-            ego_pos.y = self._y
-            leftbottom = ego_pos - self.ego_relpos
+            leftbottom = Point(ego.pos.x - self.ego_relpos.x,
+                               self._y - self.ego_relpos.y)
             righttop = leftbottom + self.limits
             return Rect(leftbottom, righttop)
         self._y = 0
@@ -48,19 +55,36 @@ class Camera:
 class Scene:
     actors: ActorList
     ego: Car
-    threads: List[threading.Thread]
+    checkpoints: Dict[int, Checkpoint]
+
+    # Shared by all the scenes, to reuse the frames rendered by earlier runs
+    frame_cache: FrameCache = None
+    # Shared by all the scenes, to time the stages of their runs
+    profiler: Profiler = None
+    # Render workers of the runs that do not ask for a number, by default
+    # one per CPU
+    workers: int = None
+    # Segments of the runs that do not ask for a number, or None to render
+    # them in order
+    segments: int = None
+
+    # Seconds between keyframes of segmented videos, which segments start on
+    SEGMENT_TIME = 2
+    # Cost of rendering and encoding a frame, in artists, to balance segments
+    FRAME_COST = 4
 
     def __init__(self, root_dir: str, name: str, duration: float,
                  fps: float = 60, speed_factor: float = 1,
                  fig_size: Tuple[int, int] = (16, 12), dpi: int = 100,
-                 debug=False) -> None:
+                 debug=False, dump_png: bool = False,
+                 checkpoint_dir: str = None) -> None:
         self.root_dir = root_dir
         self.pic_dir = os.path.join(root_dir, name)
+        self.video_file = os.path.join(root_dir, f"{name}.mp4")
         self.name = name
 
-        if os.path.isdir(self.pic_dir):
-            shutil.rmtree(self.pic_dir)
-        os.mkdir(self.pic_dir)
+        # Frames are streamed to ffmpeg, unless PNG files are asked for
+        self.dump_png = dump_png
 
         # Animation setting
         self.duration = duration
@@ -68,6 +92,7 @@ class Scene:
         self.fps = fps
         self.cnt = 0
         self.time = 0
+        self.frame = 0
         self.view = None
         self.fig_size = fig_size
         self.dpi = dpi
@@ -82,7 +107,17 @@ class Scene:
         self.actors = ActorList()
         self.ego = None
 
-        self.threads = []
+        # Durations to hold frames for, by frame
+        self.holds = {}
+
+        # Simulation states by frame, to resume later runs from. With
+        # checkpoint_dir, they are also kept there for later processes.
+        self.checkpoints = {}
+        self.checkpoint_dir = checkpoint_dir
+        self.checkpoint_files = None
+        # Whether the state was stepped by fast_forward, and is only an
+        # approximation that checkpoints are not taken of
+        self.approximate = False
 
     def set_ego(self, ego: Car) -> None:
         self.ego = ego
@@ -95,46 +130,51 @@ class Scene:
         filename = f"{self.cnt:06d}.png"
         return os.path.join(self.pic_dir, filename)
 
-    def plot(self, multithread: bool) -> None:
-        f = plt.figure(figsize=self.fig_size, dpi=self.dpi)
-        plt.xlim(self.view.leftbottom.x, self.view.righttop.x)
-        plt.ylim(self.view.leftbottom.y, self.view.righttop.y)
-        ax = plt.gca()
-        for spine in ax.spines.values():
-            spine.set_visible(False)
-
-        self.actors.plot()
-
-        if self.debug:
-            plt.title(f"{self.time:.1f} s")
-        else:
-            ax.get_yaxis().set_visible(False)
-            ax.get_xaxis().set_visible(False)
-            plt.tight_layout(pad=0)
-
-        def savefig_func(f: Figure, filename: str):
-            f.savefig(filename)
-            plt.close(f)
-
-        filename = self.get_filename()
-        if multithread:
-            while len(self.threads) > 30:
-                self.threads = [t for t in self.threads if t.is_alive()]
-                time.sleep(.1)
-            t = threading.Thread(target=savefig_func, args=(f, filename))
-            t.start()
-            self.threads.append(t)
-        else:
-            savefig_func(f, filename)
-
+    def snapshot(self) -> Snapshot:
+        from Renderer import Recorder, pixels_per_unit
+
+        title = f"{self.time:.1f} s" if self.debug else None
+        # Debug frames have axes, which the layers would draw over
+        recorder = Recorder(self.view, title, pixels_per_unit(
+            self.view, self.fig_size, self.dpi), layered=not self.debug)
+        self.actors.plot(recorder)
+        return recorder.snapshot
+
+    def plot(self, pool: RenderPool) -> None:
+        filename = self.get_filename() if self.dump_png else None
+        snapshot = self.snapshot()
+        cache_file = None
+        if self.frame_cache:
+            key = self.frame_cache.key(snapshot, self.fig_size, self.dpi,
+                                       self.debug)
+            cache_file = self.frame_cache.get_filename(key, self.dump_png)
+            if self.frame_cache.lookup(cache_file):
+                snapshot = None
+        pool.submit(snapshot, filename, cache_file)
         self.cnt += 1
 
+    def hold(self, time: float, duration: float) -> None:
+        """Hold the frame at time for duration more seconds of the video."""
+        self.holds[int(time * self.fps)] = duration
+
+    def _hold(self, pool: RenderPool, duration: float) -> None:
+        cnt = int(duration * self.fps)
+        filenames = None
+        if self.dump_png:
+            filenames = []
+            for _ in range(cnt):
+                filenames.append(self.get_filename())
+                self.cnt += 1
+        pool.hold(cnt, filenames)
+
     def step(self, time: float = None) -> None:
         if time is not None:
             self.time = time
+            self.frame = round(time * self.fps / self.speed_factor)
         else:
             dt = 1 / self.fps * self.speed_factor
             self.time += dt
+            self.frame += 1
 
         # Step ego vehicle to get the correct view first
         self.ego.step(self.time, self.camera.get_view(self.ego))
@@ -142,48 +182,307 @@ class Scene:
 
         self.actors.step(self.time, self.view)
 
+    def _open_checkpoint_dir(self) -> None:
+        # The objects of the built scene are only saved as references, so
+        # this has to be done before the first step
+        if self.checkpoint_dir and self.checkpoint_files is None:
+            # Frames are of other times with other settings
+            self.checkpoint_files = CheckpointDir(
+                os.path.join(self.checkpoint_dir, self.name),
+                [self.camera, self.actors, self.ego],
+                {"fps": self.fps, "speed_factor": self.speed_factor,
+                 "duration": self.duration})
+
+    def _checkpoint(self) -> Checkpoint:
+        return Checkpoint([self.camera, self.actors, self.ego],
+                          time=self.time, view=self.view, frame=self.frame)
+
+    def _save_checkpoint(self) -> None:
+        if self.approximate:
+            return
+        checkpoint = self._checkpoint()
+        self.checkpoints[self.frame] = checkpoint
+        if self.checkpoint_files:
+            self.checkpoint_files.save(self.frame, checkpoint)
+
+    def _restore(self, checkpoint: Checkpoint) -> None:
+        values = checkpoint.restore()
+        self.time = values["time"]
+        self.view = values["view"]
+        self.frame = values["frame"]
+
+    def _load_checkpoint(self, frame: int) -> bool:
+        frames = set(self.checkpoints)
+        if self.checkpoint_files:
+            frames.update(self.checkpoint_files.frames())
+        # Up to half a frame later, for the rounding of the time
+        time = (frame + .5) / self.fps * self.speed_factor
+
+        for f in sorted((f for f in frames if f <= frame), reverse=True):
+            checkpoint = self.checkpoints.get(f)
+            if checkpoint is None:
+                checkpoint = self.checkpoint_files.load(f)
+                if checkpoint is None:
+                    continue
+                self.checkpoints[f] = checkpoint
+            if checkpoint.values["time"] > time:
+                continue
+            self._restore(checkpoint)
+            self.approximate = False
+            return True
+        return False
+
+    def save_checkpoint(self, time: float = None) -> None:
+        """Save the state of the scene, after stepping it to time if given."""
+        self._open_checkpoint_dir()
+        if self.approximate:
+            raise Exception("Scene was fast-forwarded, its state is only "
+                            "approximate")
+        if self.view is None:
+            self.step(0)  # init
+        if time is not None:
+            frame = int(time * self.fps)
+            if frame < self.frame:
+                raise Exception(f"Scene is already past {time} s")
+            while self.frame < frame:
+                self.step()
+        self._save_checkpoint()
+
+    def load_checkpoint(self, time: float) -> bool:
+        """Restore the latest checkpoint before time, from memory or from
+        checkpoint_dir. Get whether there was one."""
+        self._open_checkpoint_dir()
+        return self._load_checkpoint(int(time * self.fps))
+
+    def fast_forward(self, time: float, dt: float) -> None:
+        """Step to time with a coarse dt. Measurements are sampled at most
+        once per step, so the state is only an approximation of the one
+        stepped at fps. The samples missed are skipped, so that sampling
+        goes on at its period from time. No checkpoint is taken from then
+        on."""
+        self.approximate = True
+        while self.time + dt < time:
+            self.step(self.time + dt)
+        self.step(time)
+        self.actors.catch_up(self.time)
+
     def run(self, start_time: float = None, end_time: float = None,
-            ending_freeze_time: float = None, multithread: bool = True) -> None:
-        self.step(0)  # init
+            ending_freeze_time: float = None, workers: int = None,
+            checkpoint_interval: float = None,
+            fast_forward_dt: float = None, segments: int = None) -> None:
+        """Render the frames in [start_time, end_time).
+
+        The simulation resumes from the latest checkpoint before start_time,
+        and with checkpoint_interval, checkpoints are taken every that many
+        seconds for later runs, which are also written to checkpoint_dir.
+        With fast_forward_dt, the remaining steps before start_time are
+        stepped with that dt. With segments, or Scene.segments, the video is
+        rendered in that many segments at the same time, see
+        _run_segments().
+        """
+        started = time.perf_counter()
+
+        # The simulation is stepped here, and only the rasterization of the
+        # snapshots is done by the workers. So random measurements are drawn
+        # in the same order whatever the number of workers.
+        if workers is None:
+            workers = self.workers if self.workers else os.cpu_count()
+        if segments is None:
+            segments = self.segments
+        if self.profiler:
+            self.profiler.begin(self)
+
         steps = int(self.duration * self.fps)
 
         start = int(start_time * self.fps) if start_time is not None else 0
         end = int(end_time * self.fps) if end_time is not None else steps
+        end = min(end, steps)
+        interval = max(1, round(checkpoint_interval * self.fps)) \
+            if checkpoint_interval else None
+
+        self._open_checkpoint_dir()
+        if not self._load_checkpoint(start):
+            self.step(0)  # init
+        if fast_forward_dt and self.frame < start:
+            self.fast_forward(start / self.fps * self.speed_factor,
+                              fast_forward_dt)
+
+        # Frames dumped as PNG files are numbered from the start of the run
+        if segments and segments > 1 and not self.dump_png and \
+                not can_fork():
+            print(f"{self.name} is rendered in order, as processes can't be "
+                  f"forked here")
+            segments = None
+        if segments and segments > 1 and not self.dump_png:
+            self._run_segments(start, end, segments, workers, interval,
+                               ending_freeze_time, started)
+        else:
+            self._render(start, end, workers, interval, ending_freeze_time,
+                         started)
+
+        if self.profiler:
+            self.profiler.end()
+            print(f"{self.name} profile:\n{self.profiler}")
 
-        with alive_bar(end - start, title=self.name) as bar:
-            for i in range(steps):
-                if i >= start and i < end:
-                    self.plot(multithread)
+    def _render(self, start: int, end: int, workers: int, interval: int,
+                ending_freeze_time: float, started: float,
+                gop: int = None) -> None:
+        """Step from the current frame to end, rendering the frames from
+        start."""
+        from alive_progress import alive_bar
+        from Renderer import RenderPool
+
+        self.cnt = 0
+        if self.dump_png:
+            if os.path.isdir(self.pic_dir):
+                shutil.rmtree(self.pic_dir)
+            os.mkdir(self.pic_dir)
+
+        encoder = None if self.dump_png else \
+            VideoEncoder(self.video_file, self.fps, gop)
+        if self.frame_cache:
+            self.frame_cache.begin()
+
+        # On errors, ffmpeg is stopped rather than left with a truncated video
+        with encoder if encoder else nullcontext(), \
+                RenderPool(workers, self.fig_size, self.dpi, self.debug,
+                           encoder) as pool, \
+                alive_bar(end - start, title=self.name) as bar:
+            for i in range(self.frame, end):
+                if interval and i % interval == 0 and \
+                        i not in self.checkpoints:
+                    self._save_checkpoint()
+                if i >= start:
+                    self.plot(pool)
                     bar()
+                    if i in self.holds:
+                        self._hold(pool, self.holds[i])
+                # No need to step after the last frame
+                if i + 1 < end:
+                    self.step()
+
+            if ending_freeze_time is not None:
+                self._hold(pool, ending_freeze_time)
+
+        if pool.first_frame_time is not None:
+            print(f"{self.name} first frame after "
+                  f"{pool.first_frame_time - started:.2f} s")
+        if self.frame_cache:
+            self.frame_cache.end()
+            print(f"{self.name} frame cache: {self.frame_cache}")
+
+    def _run_segments(self, start: int, end: int, segments: int,
+                      workers: int, interval: int, ending_freeze_time: float,
+                      started: float) -> None:
+        """Render the frames in [start, end) in segments, each by its own
+        process, into videos joined without encoding them again.
+
+        The simulation is stepped through once first, without rendering. It
+        takes checkpoints where segments may start, every SEGMENT_TIME
+        seconds so that they start on keyframes, and counts the artists of
+        every frame. The segments are cut to have about the same artists,
+        and the processes are forked to render them from their checkpoints,
+        sharing the workers.
+        """
+        gop = max(1, round(self.SEGMENT_TIME * self.fps))
+        # Only for the segments of this run, also when approximate
+        starts = {}
+        costs = []
+        for i in range(self.frame, end):
+            if interval and i % interval == 0 and \
+                    i not in self.checkpoints:
+                self._save_checkpoint()
+            if i >= start and (i - start) % gop == 0:
+                starts[i] = self._checkpoint()
+            if i >= start:
+                costs.append(self.FRAME_COST + len(self.snapshot().calls))
+            if i + 1 < end:
                 self.step()
 
-        for t in self.threads:
-            t.join()
-
-        if ending_freeze_time is not None:
-            frame_cnt = int(ending_freeze_time * self.fps)
-            self.cnt -= 1
-            last_frame = self.get_filename()
-            for _ in range(frame_cnt):
-                self.cnt += 1
-                filename = self.get_filename()
-                shutil.copy(last_frame, filename)
+        bounds = split_costs(costs, gop, segments)
+        bounds = [start + b for b in bounds] + [end]
+
+        segment_dir = os.path.join(self.root_dir, f"{self.name}.segments")
+        os.makedirs(segment_dir, exist_ok=True)
+        files = [os.path.join(segment_dir, f"{i:03d}.mp4")
+                 for i in range(len(bounds) - 1)]
+
+        # Forked, so that the segments start from the checkpoints in memory
+        context = multiprocessing.get_context("fork")
+        processes = []
+        for i, file in enumerate(files):
+            last = i == len(files) - 1
+            process = context.Process(target=self._render_segment, args=(
+                i, file, starts[bounds[i]], bounds[i], bounds[i + 1],
+                max(1, workers // len(files)),
+                ending_freeze_time if last else None, started, gop))
+            process.start()
+            processes.append(process)
+        for process in processes:
+            process.join()
+        if any(process.exitcode != 0 for process in processes):
+            raise Exception(f"Rendering segments of {self.name} failed")
+
+        VideoEncoder.concat(files, self.video_file)
+        shutil.rmtree(segment_dir)
+        if self.frame_cache and not self.frame_cache.shared:
+            self.frame_cache.evict()
+
+    def _render_segment(self, i: int, file: str, checkpoint: Checkpoint,
+                        start: int, end: int, workers: int,
+                        ending_freeze_time: float, started: float,
+                        gop: int) -> None:
+        self._restore(checkpoint)
+        self.name = f"{self.name}.{i}"
+        self.video_file = file
+        # Evicted by the parent once all the segments ended
+        if self.frame_cache:
+            self.frame_cache.shared = True
+        if self.profiler:
+            self.profiler.begin(self)
+        self._render(start, end, workers, None, ending_freeze_time, started,
+                     gop)
+        if self.profiler:
+            self.profiler.end()
+            print(f"{self.name} profile:\n{self.profiler}")
 
     def to_vid(self, file: str = None) -> None:
         if not file:
-            file = os.path.join(self.root_dir, f"{self.name}.mp4")
+            file = self.video_file
         print(file)
 
-        cmd = [f"ffmpeg -y",
-               f"-framerate {self.fps}",
-               f"-i {os.path.join(self.pic_dir, '%06d.png')}",
-               f"-c:v libx264",
-               f"-profile:v high",
-               f"-crf 20",
-               f"-pix_fmt yuv420p",
-               f"-hide_banner",
-               f"-loglevel error",
-               f"{file}",
-               ]
-
-        os.system(" ".join(cmd))
+        if not self.dump_png:
+            # The video was already encoded while running
+            if file != self.video_file:
+                os.replace(self.video_file, file)
+                self.video_file = file
+            return
+
+        cmd = ["ffmpeg", "-y",
+               "-framerate", f"{self.fps}",
+               "-i", os.path.join(self.pic_dir, '%06d.png'),
+               ] + VideoEncoder.output_args() + [file]
+
+        subprocess.run(cmd, check=True)
+
+
+def can_fork() -> bool:
+    """Get whether processes can be forked safely, which macOS doesn't once
+    its frameworks are loaded, e.g. by Matplotlib."""
+    return "fork" in multiprocessing.get_all_start_methods() and \
+        sys.platform != "darwin"
+
+
+def split_costs(costs: List[float], step: int, cnt: int) -> List[int]:
+    """Cut costs into at most cnt parts of about the same total, at multiples
+    of step. Get the indices the parts start at."""
+    cumsum = np.cumsum(costs)
+    total = cumsum[-1] if len(costs) else 0
+    starts = [0]
+    for k in range(1, cnt):
+        # The first index past k parts of the total, rounded to a step
+        idx = int(np.searchsorted(cumsum, total * k / cnt))
+        idx = round(idx / step) * step
+        if starts[-1] < idx < len(costs):
+            starts.append(idx)
+    return starts
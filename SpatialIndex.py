@@ -0,0 +1,89 @@
+from __future__ import annotations
+from typing import Dict, Hashable, Set, Tuple
+import math
+
+from Point import Rect
+
+
+class SpatialIndex:
+    """Uniform grid along x of the world bounds of actors.
+
+    The camera follows the ego vehicle along x, so the world is cut in
+    columns of cell_size meters, and each actor is kept in the columns its
+    bounds span. Moving an actor only touches the columns when it crosses
+    their borders. Bounds have to be finite along x.
+    """
+    cells: Dict[int, Dict[Hashable, None]]
+    bounds: Dict[Hashable, Rect]
+    spans: Dict[Hashable, Tuple[int, int]]
+
+    def __init__(self, cell_size: float = 10) -> None:
+        self.cell_size = cell_size
+        # Dicts instead of sets, so that checkpoints pickle the same
+        self.cells = {}
+        self.bounds = {}
+        self.spans = {}
+
+    def __contains__(self, actor: Hashable) -> bool:
+        return actor in self.bounds
+
+    def __len__(self) -> int:
+        return len(self.bounds)
+
+    def _span(self, left: float, right: float) -> Tuple[int, int]:
+        return (math.floor(left / self.cell_size),
+                math.floor(right / self.cell_size))
+
+    def update(self, actor: Hashable, bounds: Rect) -> None:
+        """Set the bounds of actor, or remove it with None."""
+        if bounds is None:
+            self.remove(actor)
+            return
+
+        old = self.spans.get(actor)
+        span = self._span(bounds.leftbottom.x, bounds.righttop.x)
+        if span != old:
+            if old is not None:
+                for col in range(old[0], old[1] + 1):
+                    if col < span[0] or col > span[1]:
+                        self._unlink(actor, col)
+            for col in range(span[0], span[1] + 1):
+                if old is None or col < old[0] or col > old[1]:
+                    self.cells.setdefault(col, {})[actor] = None
+            self.spans[actor] = span
+        self.bounds[actor] = bounds
+
+    def remove(self, actor: Hashable) -> None:
+        span = self.spans.pop(actor, None)
+        if span is None:
+            return
+        for col in range(span[0], span[1] + 1):
+            self._unlink(actor, col)
+        del self.bounds[actor]
+
+    def _unlink(self, actor: Hashable, col: int) -> None:
+        cell = self.cells[col]
+        del cell[actor]
+        if not cell:
+            del self.cells[col]
+
+    def query(self, view: Rect, margin: float = 0) -> Set[Hashable]:
+        """Get the actors whose bounds meet view, grown by margin."""
+        left = view.leftbottom.x - margin
+        right = view.righttop.x + margin
+        bottom = view.leftbottom.y - margin
+        top = view.righttop.y + margin
+
+        found = set()
+        first, last = self._span(left, right)
+        for col in range(first, last + 1):
+            for actor in self.cells.get(col, ()):
+                if actor in found:
+                    continue
+                bounds = self.bounds[actor]
+                if bounds.leftbottom.x <= right and \
+                        bounds.righttop.x >= left and \
+                        bounds.leftbottom.y <= top and \
+                        bounds.righttop.y >= bottom:
+                    found.add(actor)
+        return found
@@ -1,64 +1,250 @@
 from __future__ import annotations
+import hashlib
 import os
-from scipy import ndimage
-import cairosvg
-from PIL import Image
-import matplotlib.pyplot as plt
-import matplotlib.image as mpimg
 from io import BytesIO
 import numpy as np
 import copy
+import math
+from collections import OrderedDict
+from typing import TYPE_CHECKING, Dict, Hashable, Tuple
 
 from Point import Rect
 
+# SciPy, CairoSVG and the image readers are imported where textures are
+# first loaded or rotated, so that importing actors stays quick
+if TYPE_CHECKING:
+    from Renderer import Renderer
+
+
+class RotationCache:
+    """LRU cache of the rotated images of a texture, keyed by angle."""
+    images: OrderedDict[Hashable, np.ndarray]
+
+    def __init__(self, size: int) -> None:
+        self.size = size
+        self.images = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Hashable) -> np.ndarray:
+        img = self.images.get(key)
+        if img is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+            self.images.move_to_end(key)
+        return img
+
+    def put(self, key: Hashable, img: np.ndarray) -> None:
+        self.images[key] = img
+        if len(self.images) > self.size:
+            self.images.popitem(last=False)
+
+    def __str__(self) -> str:
+        return f"{len(self.images)} images, {self.hits} hits, " \
+            f"{self.misses} misses"
+
+    def __repr__(self) -> str:
+        return self.__str__()
+
+
+class TextureStore:
+    """Process-wide store of texture images.
+
+    Each (file, rotate, rotate_degree, level) is only loaded once, and all the
+    textures get the same read-only array. Mip level k is 1 / 2**k of the
+    original size: SVG files are rasterized to that size, PNG files are
+    downsampled. If cache_dir is set, the images of every level are also kept
+    there between runs, so that files are only decoded again once changed.
+    """
+    images: Dict[tuple, np.ndarray] = {}
+    cache_dir: str = None
+
+    def __init__(self) -> None:
+        raise Exception("Wrong usage of class TextureStore")
+
+    @classmethod
+    def get(cls, file: str, rotate: int = None, rotate_degree: float = None,
+            level: int = 0) -> np.ndarray:
+        key = (file, rotate, rotate_degree, level)
+        img = cls.images.get(key)
+        if img is not None:
+            return img
+
+        if rotate is None and rotate_degree is None:
+            img = cls._load(file, level)
+        else:
+            img = cls.get(file, level=level)
+        if rotate is not None:
+            img = np.rot90(img, rotate)
+        if rotate_degree is not None:
+            from scipy import ndimage
+            img = ndimage.rotate(img, rotate_degree)
+            img = np.clip(img, 0, 1, out=img)
+        img.flags.writeable = False
+        cls.images[key] = img
+        return img
+
+    @classmethod
+    def _load(cls, file: str, level: int = 0) -> np.ndarray:
+        ext = os.path.splitext(file)[1]
+        if ext not in (".svg", ".png"):
+            raise Exception(f"Unsupported texture type: {ext}")
+
+        cache_file = cls._cache_file(file, level)
+        if cache_file and os.path.isfile(cache_file):
+            return np.load(cache_file, mmap_mode="r")
+
+        img = cls._decode(file, ext, level)
+        if cache_file:
+            os.makedirs(cls.cache_dir, exist_ok=True)
+            # Written aside first, as other processes may be loading it
+            tmp_file = f"{cache_file}.{os.getpid()}.tmp"
+            with open(tmp_file, "wb") as f:
+                np.save(f, img)
+            os.replace(tmp_file, cache_file)
+        return img
+
+    @classmethod
+    def _decode(cls, file: str, ext: str, level: int) -> np.ndarray:
+        if level == 0 and ext == ".svg":
+            return cls._load_svg(file)
+        elif level == 0:
+            import matplotlib.image as mpimg
+            return mpimg.imread(file)
+
+        img = cls.get(file)
+        if ext == ".svg":
+            height, width = img.shape[:2]
+            size = (max(1, width >> level), max(1, height >> level))
+            return cls._load_svg(file, size)
+        return cls._downsample(img, level)
+
+    @classmethod
+    def _downsample(cls, img: np.ndarray, level: int) -> np.ndarray:
+        # Average blocks of 2**level x 2**level pixels
+        factor = 2 ** level
+        height = max(1, img.shape[0] // factor)
+        width = max(1, img.shape[1] // factor)
+        img = img[:height * factor, :width * factor]
+        # Grayscale images keep their 2 dimensions
+        blocks = img.reshape((height, img.shape[0] // height,
+                              width, img.shape[1] // width) + img.shape[2:])
+        return blocks.mean(axis=(1, 3)).astype(img.dtype)
+
+    @classmethod
+    def _load_svg(cls, file: str, size: Tuple[int, int] = None) -> np.ndarray:
+        import cairosvg
+        from PIL import Image
+
+        if size:
+            png = cairosvg.svg2png(url=file, output_width=size[0],
+                                   output_height=size[1])
+        else:
+            png = cairosvg.svg2png(url=file)
+        return np.array(Image.open(BytesIO(png)))
+
+    @classmethod
+    def _cache_file(cls, file: str, level: int = 0) -> str:
+        if not cls.cache_dir:
+            return None
+        stat = os.stat(file)
+        key = f"{os.path.abspath(file)}:{stat.st_mtime_ns}:{stat.st_size}:{level}"
+        digest = hashlib.sha1(key.encode()).hexdigest()[:16]
+        name = os.path.splitext(os.path.basename(file))[0]
+        return os.path.join(cls.cache_dir, f"{name}-{digest}.npy")
+
 
 class Texture:
     img: np.array
 
+    # The images are derived again by every draw(), so checkpoints keep
+    # textures as they are.
+    CHECKPOINT = False
+
     IMAGE_STYLE = {
         "zorder": 10,
     }
 
+    # rotate_to() rounds angles to ROTATE_STEP degrees, and caches the rotated
+    # images. Textures loaded from the same file with the same initial rotation
+    # share a cache.
+    ROTATE_STEP = .25
+    ROTATION_CACHE_SIZE = 256
+    rotation_caches: Dict[tuple, RotationCache] = {}
+
+    # draw() uses the smallest mip level of TextureStore that is still at
+    # least as big as the texture on the screen.
+    MAX_LEVEL = 5
+
     def __init__(self, file: str, rotate: int = None,
                  rotate_degree: float = None,
                  image_style: dict = None) -> None:
         self.file = file
-        self.img = None
-        self._load_texture()
+        self.transform = (rotate, rotate_degree)
+        self.level = 0
+        self.degree = None
+        self.img_original = TextureStore.get(file, rotate, rotate_degree)
+        self.img = self.img_original
         self.image_style = image_style if image_style else copy.deepcopy(
             self.IMAGE_STYLE)
 
-        if rotate is not None:
-            self.rotate90(rotate)
-        if rotate_degree is not None:
-            self.rotate(rotate_degree)
-
-        self.img_original = copy.deepcopy(self.img)
+        self.rotation_cache = self.rotation_caches.setdefault(
+            (file, rotate, rotate_degree),
+            RotationCache(self.ROTATION_CACHE_SIZE))
 
-    def _load_texture(self) -> None:
-        ext = os.path.splitext(self.file)[1]
-        if ext == ".svg":
-            png = cairosvg.svg2png(url=self.file)
-            img = Image.open(BytesIO(png))
-            self.img_original = np.array(img)
-        elif ext == ".png":
-            self.img_original = mpimg.imread(self.file)
-        else:
-            raise Exception(f"Unsupported texture type: {ext}")
-        self.img = copy.deepcopy(self.img_original)
+    def __reduce__(self) -> tuple:
+        # Pickled as the arguments to load it again from TextureStore
+        return (Texture, (self.file, *self.transform, self.image_style))
 
     def rotate90(self, k: int) -> None:
         self.img = np.rot90(self.img, k)
 
     def rotate(self, degree: float) -> None:
+        from scipy import ndimage
         self.img = ndimage.rotate(self.img, degree)
         self.img = np.clip(self.img, 0, 1)
 
     def rotate_to(self, degree: float) -> None:
-        self.img = ndimage.rotate(self.img_original, degree)
-        self.img = np.clip(self.img, 0, 1)
+        degree = round(degree / self.ROTATE_STEP) * self.ROTATE_STEP % 360
+        self.degree = degree
+        self.img = self.rotation_cache.get((self.level, degree))
+        if self.img is None:
+            from scipy import ndimage
+            img = ndimage.rotate(self.img_original, degree)
+            self.img = np.clip(img, 0, 1, out=img)
+            # Shared by all the textures of the cache
+            self.img.flags.writeable = False
+            self.rotation_cache.put((self.level, degree), self.img)
+
+    def get_level(self, width: float, height: float) -> int:
+        """Get the mip level to draw the texture on width x height pixels."""
+        img = TextureStore.get(self.file, *self.transform)
+        ratio = min(img.shape[1] / width if width > 0 else math.inf,
+                    img.shape[0] / height if height > 0 else math.inf)
+        if ratio < 2:
+            return 0
+        elif math.isinf(ratio):
+            return self.MAX_LEVEL
+        return min(int(math.log2(ratio)), self.MAX_LEVEL)
+
+    def set_level(self, level: int) -> None:
+        if level == self.level:
+            return
+        self.level = level
+        self.img_original = TextureStore.get(self.file, *self.transform, level)
+        if self.degree is None:
+            self.img = self.img_original
+        else:
+            self.rotate_to(self.degree)
+
+    def draw(self, renderer: Renderer, key: Hashable, rect: Rect) -> None:
+        if renderer.pixels_per_unit:
+            size = (rect.righttop - rect.leftbottom) * renderer.pixels_per_unit
+            self.set_level(self.get_level(abs(size.x), abs(size.y)))
 
-    def draw(self, rect: Rect) -> None:
-        plt.gca().imshow(self.img, extent=(rect.leftbottom.x, rect.righttop.x,
-                                           rect.leftbottom.y, rect.righttop.y),
-                         **self.image_style)
+        renderer.image(key, self.img, extent=(rect.leftbottom.x,
+                                              rect.righttop.x,
+                                              rect.leftbottom.y,
+                                              rect.righttop.y),
+                       **self.image_style)
@@ -0,0 +1,45 @@
+#! /bin/env python3
+
+"""Time a fresh process up to its first frame: importing the modules,
+building and stepping a scene, and rendering the frame.
+
+Run from anywhere: python benchmarks/first_frame.py [texture_cache_dir]
+
+Prints the times since the start of the script as JSON. suite.py runs it in
+a new process, so that nothing is imported or cached yet.
+"""
+
+import time
+STARTED = time.perf_counter()
+
+import json
+import sys
+
+from scenes import build_scene
+from Texture import TextureStore
+
+
+def main():
+    if len(sys.argv) > 1:
+        TextureStore.cache_dir = sys.argv[1]
+    times = {"import": time.perf_counter() - STARTED}
+
+    scene = build_scene()
+    # Like the ego vehicles of the scenes, which are not rotated
+    scene.ego.texture_rotate = False
+    scene.step(0)
+    times["build"] = time.perf_counter() - STARTED
+
+    from Renderer import Renderer
+    renderer = Renderer(scene.fig_size, scene.dpi)
+    renderer.warm_up()
+    times["warm up"] = time.perf_counter() - STARTED
+
+    renderer.render(scene.snapshot())
+    renderer.buffer_rgba()
+    times["first frame"] = time.perf_counter() - STARTED
+    print(json.dumps(times))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+"""Synthetic scenes for the benchmarks, sized by the number of actors."""
+
+from __future__ import annotations
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+sys.path.insert(0, ROOT)
+CAR_TEXTURE = os.path.join(ROOT, "pics", "car-top.svg")
+
+import numpy as np
+
+from Actor import *
+from Controller import *
+from Scene import Scene
+
+
+def build_scene(cars: int = 3, trajectories: int = 4, overlays: int = 4,
+                duration: float = 60, fps: float = 60,
+                textures: bool = True) -> Scene:
+    """Build a scene like scene1 and scene2: a road, an ego vehicle followed
+    by the camera, cars driving in the lanes around it, measurement
+    trajectories of the ego vehicle, and texts and poly lines fixed on the
+    screen, alternately."""
+    np.random.seed(0)
+
+    scene = Scene("/tmp", "bench", duration, fps)
+    scene.add_actor(Road())
+
+    for i in range(cars):
+        # Spread along the lanes, some of them in view
+        lane = i % 3
+        npc = Car(pos=Point(-30 + 15 * (i // 3) + 5 * lane, 4 * lane - 4),
+                  controller=Controller(Point(10 + 3 * lane, 0)),
+                  appear_once=False)
+        if textures:
+            npc.load_texture(CAR_TEXTURE)
+        scene.add_actor(npc)
+
+    controller = PIDController(Point(15, 0), yref=0, pid=(1, .2, 0))
+    scene.set_ego(Car(pos=Point(0, 0), controller=controller,
+                      appear_once=False))
+    if textures:
+        scene.ego.load_texture(CAR_TEXTURE)
+        scene.ego.texture_rotate = True
+    scene.add_actor(scene.ego)
+
+    for i in range(trajectories):
+        get_pos = GetPos.gausian_meas(scale=Point(.4, .4)) if i else None
+        meas = Trajectory(scene.ego, get_pos, .1)
+        scene.add_actor(meas)
+        controller.meas = meas
+
+    for i in range(overlays):
+        pos = Point(2 + 8 * (i // 16), 18 - i % 16)
+        if i % 2:
+            scene.add_actor(PolyLine(pos, [Point(1, 0), Point(0, -.5),
+                                           Point(1, 0)], 1))
+        else:
+            scene.add_actor(Text(f"Text {i}", pos, add_box=True))
+    return scene
@@ -0,0 +1,45 @@
+#! /bin/env python3
+
+"""Time the simulation of a scene, without rendering.
+
+Run from anywhere: python benchmarks/step.py [steps]
+"""
+
+from __future__ import annotations
+import sys
+import time
+
+from scenes import build_scene
+
+
+def timed(func: callable, steps: int, repeat: int) -> float:
+    """Get the best time per call of func over repeat runs of steps calls."""
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(steps):
+            func()
+        best = min(best, (time.perf_counter() - start) / steps)
+    return best
+
+
+def bench(steps: int, repeat: int = 5) -> dict:
+    scene = build_scene(textures=False)
+    scene.step(0)
+
+    def step_and_snapshot():
+        scene.step()
+        scene.snapshot()
+
+    return {"step": timed(scene.step, steps, repeat),
+            "step+snapshot": timed(step_and_snapshot, steps, repeat)}
+
+
+def main():
+    steps = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    for name, t in bench(steps).items():
+        print(f"{name:>14}: {t * 1e6:7.1f} us")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,218 @@
+#! /bin/env python3
+
+"""Time the parts of making a video separately, as scenes grow.
+
+Run from anywhere: python benchmarks/suite.py [--sizes 1,4,16,64]
+    [--out FILE] [--compare FILE]
+
+Synthetic scenes with more and more cars are stepped, plotted and rendered,
+and the textures, trajectories and points they are made of are timed on
+their own. The time to the first frame of a new process is timed by
+first_frame.py, without and with rasterized textures cached on disk.
+Results are written as JSON, by default to .cache/benchmarks/<commit>.json,
+and --compare prints how much faster they are than the results of another
+commit.
+"""
+
+from __future__ import annotations
+from typing import Callable, List
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+import matplotlib
+import numpy as np
+
+from scenes import CAR_TEXTURE, ROOT, build_scene
+from step import timed
+
+from Actor import Trajectory
+from Point import Point, PointArray, Rect
+from Renderer import Recorder, Renderer, pixels_per_unit
+from Texture import RotationCache, Texture
+
+TRAJECTORIES = 4
+OVERLAYS = 8
+
+
+class Results:
+    """Timings by benchmark and size, in seconds per call."""
+    rows: List[dict]
+
+    def __init__(self) -> None:
+        self.rows = []
+
+    def add(self, name: str, n: int, unit: str, seconds: float) -> None:
+        self.rows.append({"name": name, "n": n, "unit": unit,
+                          "seconds": seconds, "per_second": 1 / seconds})
+        print(f"{name:>24} {n:>6} {unit:<7} {seconds * 1e6:12.1f} us "
+              f"{1 / seconds:12.1f} /s")
+
+    def save(self, filename: str) -> None:
+        data = {"commit": get_commit(), "time": time.time(),
+                "python": platform.python_version(),
+                "numpy": np.__version__, "matplotlib": matplotlib.__version__,
+                "machine": platform.machine(), "cpus": os.cpu_count(),
+                "results": self.rows}
+        os.makedirs(os.path.dirname(os.path.abspath(filename)), exist_ok=True)
+        with open(filename, "w") as f:
+            json.dump(data, f, indent=1)
+
+    def compare(self, filename: str) -> None:
+        """Print the speedup of each timing over the same one in filename."""
+        with open(filename) as f:
+            data = json.load(f)
+        old = {(row["name"], row["n"]): row["seconds"]
+               for row in data["results"]}
+        print(f"speedup over {data['commit']}:")
+        for row in self.rows:
+            seconds = old.get((row["name"], row["n"]))
+            if seconds is not None:
+                print(f"{row['name']:>24} {row['n']:>6} "
+                      f"{seconds / row['seconds']:8.2f}x")
+
+
+def get_commit() -> str:
+    try:
+        return subprocess.run(["git", "describe", "--always", "--dirty"],
+                              cwd=ROOT, capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def timed_each(func: Callable[[object], None], args: list) -> float:
+    """Get the mean time of func over args, called in order once each, for
+    calls that depend on the ones before."""
+    start = time.perf_counter()
+    for arg in args:
+        func(arg)
+    return (time.perf_counter() - start) / len(args)
+
+
+def bench_first_frame(results: Results) -> None:
+    script = os.path.join(ROOT, "benchmarks", "first_frame.py")
+    with tempfile.TemporaryDirectory() as cache_dir:
+        for cache in ("cold", "warm"):
+            start = time.perf_counter()
+            out = subprocess.run([sys.executable, script, cache_dir],
+                                 capture_output=True, text=True, check=True)
+            total = time.perf_counter() - start
+            times = json.loads(out.stdout.splitlines()[-1])
+            for stage, seconds in times.items():
+                results.add(f"startup {stage} {cache}", 1, "process",
+                            seconds)
+            results.add(f"startup process {cache}", 1, "process", total)
+
+
+def bench_scene(results: Results, cars: int, frames: int) -> None:
+    scene = build_scene(cars, TRAJECTORIES, OVERLAYS)
+    scene.step(0)
+    results.add("Scene.step", cars, "cars", timed(scene.step, frames, 3))
+
+    def plot():
+        recorder = Recorder(scene.view, None, pixels_per_unit(
+            scene.view, scene.fig_size, scene.dpi), layered=True)
+        scene.actors.plot(recorder)
+    results.add("ActorList.plot", cars, "cars", timed(plot, frames, 3))
+
+    # Frames of successive steps, as the renderer reuses what it drew
+    snapshots = []
+    for _ in range(frames):
+        scene.step()
+        snapshots.append(scene.snapshot())
+    renderer = Renderer(scene.fig_size, scene.dpi)
+
+    def render(snapshot):
+        renderer.render(snapshot)
+        renderer.buffer_rgba()
+    render(snapshots[0])
+    results.add("Renderer.render", cars, "cars", timed_each(render,
+                                                             snapshots[1:]))
+
+    with tempfile.TemporaryDirectory() as directory:
+        filename = os.path.join(directory, "frame.png")
+
+        def savefig(snapshot):
+            renderer.render(snapshot)
+            renderer.savefig(filename)
+        results.add("Renderer.savefig", cars, "cars",
+                    timed_each(savefig, snapshots[:max(1, frames // 4)]))
+
+
+def bench_texture(results: Results) -> None:
+    texture = Texture(CAR_TEXTURE, 3)
+    angles = np.arange(0, 2, Texture.ROTATE_STEP)
+    # Every angle rotates the image once, then they are cached
+    texture.rotation_cache = RotationCache(Texture.ROTATION_CACHE_SIZE)
+    results.add("Texture.rotate_to", len(angles), "angles",
+                timed_each(texture.rotate_to, angles))
+    results.add("Texture.rotate_to cached", len(angles), "angles",
+                timed_each(texture.rotate_to, angles))
+
+
+def bench_trajectory(results: Results, points: int) -> None:
+    scene = build_scene(0, 1, 0, textures=False)
+    scene.step(0)
+    traj = next(actor for actor in scene.actors.actors
+                if isinstance(actor, Trajectory))
+    x = np.linspace(0, 30, points)
+    for i in range(points):
+        traj.trajectory.append(x[i], np.sin(x[i]), i / points)
+    traj.time = 1
+
+    def plot():
+        traj._plot(Recorder(scene.view))
+    results.add("Trajectory._plot", points, "points", timed(plot, 200, 3))
+
+
+def bench_point(results: Results, points: int) -> None:
+    a, b = Point(1.5, 2.5), Point(3, -1)
+    ops = {"Point +": lambda: a + b, "Point -": lambda: a - b,
+           "Point *": lambda: a * 1.5, "Point.dis": lambda: a.dis(b)}
+    for name, op in ops.items():
+        results.add(name, 1, "points", timed(op, 100000, 3))
+
+    array = PointArray(np.arange(points), np.arange(points))
+    view = Rect(Point(10, 10), Point(40, 30))
+    ops = {"PointArray +": lambda: array + b,
+           "PointArray.dis": lambda: array.dis(b),
+           "Rect.contains": lambda: view.contains(array)}
+    for name, op in ops.items():
+        results.add(name, points, "points", timed(op, 1000, 3))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--sizes", default="1,4,16,64",
+                        help="numbers of cars of the scenes")
+    parser.add_argument("--frames", type=int, default=60,
+                        help="frames to step and render for each size")
+    parser.add_argument("--out", help="JSON file to write the results to")
+    parser.add_argument("--compare", help="JSON file of earlier results")
+    args = parser.parse_args()
+
+    results = Results()
+    bench_first_frame(results)
+    for cars in map(int, args.sizes.split(",")):
+        bench_scene(results, cars, args.frames)
+    bench_texture(results)
+    for points in (100, 1000, 10000):
+        bench_trajectory(results, points)
+    bench_point(results, 1000)
+
+    out = args.out or os.path.join(ROOT, ".cache", "benchmarks",
+                                   f"{get_commit()}.json")
+    results.save(out)
+    print(out)
+    if args.compare:
+        results.compare(args.compare)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,3 +1,5 @@
+from colour import Color
+
 from Scene import Scene
 from Point import Point
 from Actor import *
@@ -1,10 +1,28 @@
 #! /bin/env python3
 
 from __future__ import annotations
+from functools import partial
 import os
 
 from scene1 import scene1
 from scene2 import scene2
+from FrameCache import FrameCache
+from RenderJobs import RenderJobs
+from Scene import Scene
+from Texture import TextureStore
+
+
+def setup(dir_path: str, video_dir: str, profile: bool) -> None:
+    """Set up the scenes of a render job."""
+    # Keep rasterized textures between runs
+    TextureStore.cache_dir = os.path.join(dir_path, ".cache", "textures")
+    # Only render the frames that changed since the last run, the cache is
+    # shared by the jobs and evicted once they all ended
+    Scene.frame_cache = FrameCache(os.path.join(dir_path, ".cache", "frames"),
+                                   shared=True)
+    if profile:
+        from Profiler import Profiler
+        Scene.profiler = Profiler(video_dir)
 
 
 def main():
@@ -16,9 +34,18 @@ def main():
 
     debug = False
     high_quality = True
-
-    scene1(video_dir, debug=debug, high_quality=high_quality)
-    scene2(video_dir, debug=debug, high_quality=high_quality)
+    # Time the stages of the runs, into Chrome traces next to the videos
+    profile = False
+
+    # The scenes are rendered at the same time, sharing the CPUs
+    jobs = RenderJobs(setup=partial(setup, dir_path, video_dir, profile))
+    # Weighted by about the seconds of the scenes, so that they end together
+    jobs.submit(scene1, video_dir, debug=debug, high_quality=high_quality,
+                weight=23)
+    jobs.submit(scene2, video_dir, debug=debug, high_quality=high_quality,
+                weight=83)
+    jobs.run()
+    FrameCache(os.path.join(dir_path, ".cache", "frames")).evict()
 
 
 if __name__ == "__main__":